@@ -79,6 +79,15 @@ class PostAdmin(admin.ModelAdmin):
         else:
             return 'id'
 
+    def save_formset(self, request, form, formset, change):
+        super(PostAdmin, self).save_formset(request, form, formset, change)
+        added = len(formset.new_objects) - len(formset.deleted_objects)
+        counter = {
+            Comment: 'comments', UploadedImage: 'images',
+        }.get(formset.model)
+        if added and counter is not None:
+            Post.objects.add_counts(form.instance.id, **{counter: added})
+
 
 @admin.register(AuthUser)
 class AuthUserAdmin(DjangoUserAdmin):
@@ -117,6 +126,16 @@ class AuthUserAdmin(DjangoUserAdmin):
     def get_readonly_fields(self, request, obj=None):
         return 'id'
 
+    def get_search_results(self, request, queryset, search_term):
+        # a whole email is found by the unique index instead of LIKE
+        if '@' in search_term and len(search_term.split()) == 1:
+            users = queryset.filter(
+                email=AuthUser.objects.normalize_email(search_term),
+            )
+            if users.exists():
+                return users, False
+        return super().get_search_results(request, queryset, search_term)
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
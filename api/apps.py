@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from api import signals
+
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(
+            signals.buffer_user_login, dispatch_uid='buffer_user_login',
+        )
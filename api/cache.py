@@ -0,0 +1,226 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import quote_etag
+
+from api.models import Post
+
+__all__ = (
+    'get_feed_generation',
+    'bump_feed_generation',
+    'bump_feed_comments_generation',
+    'get_feed_cache_key',
+    'get_feed_modified',
+    'get_post_version',
+    'bump_post_versions',
+    'get_post_cache_key',
+    'get_post_modified',
+    'set_post_modified',
+    'get_etag',
+    'get_cached_response',
+    'set_cached_response',
+    'get_cache_stats',
+    'bump_user_version',
+    'get_user_cache_key',
+)
+
+FEED_GENERATION_KEY = 'posts:feed:generation'
+# pages ordered by comment count also depend on this one
+FEED_COMMENTS_GENERATION_KEY = 'posts:feed:comments:generation'
+FEED_MODIFIED_KEY = 'posts:feed:modified'
+POST_VERSION_KEY = 'posts:%s:version'
+POST_MODIFIED_KEY = 'posts:%s:%s:modified'
+STATS_KEY = 'posts:stats:%s:%s'
+USER_VERSION_KEY = 'users:%s:version'
+# only these params change the feed page, others must not split the cache
+FEED_QUERY_PARAMS = ('limit', 'offset', 'cursor', 'ordering')
+
+
+def _new_version():
+    # start from a timestamp, not 1: if the counter is evicted the new
+    # versions must not repeat old ones which can still be in the cache
+    return int(time.time() * 1000)
+
+
+def _get_version(key, create=True):
+    version = cache.get(key)
+    if version is None and create:
+        cache.add(key, _new_version(), settings.CACHE_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def _incr(key, initial):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, settings.CACHE_VERSION_TIMEOUT)
+        return cache.incr(key)
+
+
+def _bump_version(key):
+    _incr(key, _new_version())
+
+
+def _on_change(func, *args):
+    """
+    Calls func now and once more after commit, so a response rendered from
+    data that was not committed yet can't stay in the cache
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
+
+
+def _hash(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def get_feed_generation():
+    return _get_version(FEED_GENERATION_KEY)
+
+
+def _bump_feed_generation():
+    _bump_version(FEED_GENERATION_KEY)
+    cache.set(
+        FEED_MODIFIED_KEY, int(time.time()), settings.CACHE_VERSION_TIMEOUT,
+    )
+
+
+def bump_feed_generation():
+    _on_change(_bump_feed_generation)
+
+
+def _bump_feed_comments_generation():
+    _bump_version(FEED_COMMENTS_GENERATION_KEY)
+    cache.set(
+        FEED_MODIFIED_KEY, int(time.time()), settings.CACHE_VERSION_TIMEOUT,
+    )
+
+
+def bump_feed_comments_generation():
+    """
+    Drops only pages ordered by comment count, comment counts of other
+    pages are stale for up to POSTS_FEED_CACHE_TIMEOUT
+    """
+    _on_change(_bump_feed_comments_generation)
+
+
+def get_feed_cache_key(request):
+    """
+    Key of the public feed page: generation + host + page params
+    """
+    params = sorted(
+        (name, request.query_params.getlist(name))
+        for name in FEED_QUERY_PARAMS if name in request.query_params
+    )
+    raw = request.build_absolute_uri('/') + '?' + urlencode(params, True)
+    generation = get_feed_generation()
+    if request.query_params.get('ordering') == 'comments':
+        generation = '%s:%s' % (
+            generation, _get_version(FEED_COMMENTS_GENERATION_KEY),
+        )
+    return 'posts:feed:%s:%s' % (generation, _hash(raw))
+
+
+def get_feed_modified():
+    """
+    Timestamp of the last feed change. If it was evicted, now is returned:
+    a fresh response is better than a wrong `304`
+    """
+    cache.add(
+        FEED_MODIFIED_KEY, int(time.time()), settings.CACHE_VERSION_TIMEOUT,
+    )
+    return cache.get(FEED_MODIFIED_KEY)
+
+
+def get_post_version(post_id, create=True):
+    """
+    :param create: if False, None is returned when there is no version
+    """
+    return _get_version(POST_VERSION_KEY % post_id, create)
+
+
+def bump_post_versions(*post_ids):
+    for post_id in set(post_ids):
+        if post_id is not None:
+            _on_change(_bump_version, POST_VERSION_KEY % post_id)
+
+
+def get_post_cache_key(request, post_id, version=None):
+    """
+    Key of the post details: post version + host (urls are absolute)
+    """
+    if version is None:
+        version = get_post_version(post_id)
+    return 'posts:%s:%s:%s' % (
+        post_id, version, _hash(request.build_absolute_uri('/')),
+    )
+
+
+def get_post_modified(post_id, version):
+    """
+    Timestamp of `Post.date_modified` or None if there is no such post
+    """
+    modified = cache.get(POST_MODIFIED_KEY % (post_id, version))
+    if modified is None:
+        date_modified = Post.objects.filter(
+            id=post_id,
+        ).values_list('date_modified', flat=True).first()
+        modified = set_post_modified(post_id, version, date_modified)
+    return modified
+
+
+def set_post_modified(post_id, version, date_modified):
+    if date_modified is None:
+        return None
+    modified = int(date_modified.timestamp())
+    cache.set(
+        POST_MODIFIED_KEY % (post_id, version), modified,
+        settings.POSTS_DETAIL_CACHE_TIMEOUT,
+    )
+    return modified
+
+
+def get_etag(key, format):
+    """
+    Strong ETag of the content cached by key, keys include the version
+    """
+    return quote_etag(_hash('%s:%s' % (key, format)))
+
+
+def get_cached_response(key, name):
+    """
+    Returns rendered content or None, counts hits and misses of `name`
+    """
+    content = cache.get(key)
+    _incr(STATS_KEY % (name, 'misses' if content is None else 'hits'), 0)
+    return content
+
+
+def set_cached_response(key, content, timeout):
+    cache.set(key, content, timeout)
+
+
+def get_cache_stats(name):
+    return {
+        'hits': cache.get(STATS_KEY % (name, 'hits'), 0),
+        'misses': cache.get(STATS_KEY % (name, 'misses'), 0),
+    }
+
+
+def bump_user_version(user_id):
+    _on_change(_bump_version, USER_VERSION_KEY % user_id)
+
+
+def get_user_cache_key(user_id):
+    """
+    Key of the user fields needed to authenticate requests
+    """
+    return 'users:%s:%s' % (
+        user_id, _get_version(USER_VERSION_KEY % user_id),
+    )
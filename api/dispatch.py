@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+
+from planekstest.celery import app
+
+__all__ = (
+    'TaskDispatcher',
+    'dispatcher',
+)
+
+
+class TaskDispatcher:
+    """
+    Publishes tasks to the broker with a short timeout; while the broker
+    is unavailable tasks go to a bounded in-process queue, whose threads
+    retry publishing and at last run the task locally
+    """
+
+    def __init__(
+            self, timeout=None, workers=None, queue_size=None, retries=None,
+            retry_interval=None,
+    ):
+        self.timeout = settings.TASK_PUBLISH_TIMEOUT \
+            if timeout is None else timeout
+        self.workers = settings.TASK_FALLBACK_WORKERS \
+            if workers is None else workers
+        self.retries = settings.TASK_FALLBACK_RETRIES \
+            if retries is None else retries
+        # publishing is not tried for this long after a failure
+        self.retry_interval = settings.TASK_FALLBACK_RETRY_INTERVAL \
+            if retry_interval is None else retry_interval
+        self.queue = queue.Queue(
+            settings.TASK_FALLBACK_QUEUE_SIZE
+            if queue_size is None else queue_size
+        )
+        self.broker_down_until = 0
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {
+            'published': 0,
+            'fallbacks': 0,
+            'republished': 0,
+            'requeued': 0,
+            'local': 0,
+            'failed': 0,
+        }
+
+    @contextmanager
+    def connection(self):
+        """
+        Broker connection for a series of dispatch calls,
+        None if the broker is down
+        """
+        try:
+            connection = app.connection_for_write(
+                connect_timeout=self.timeout,
+            )
+        except Exception:
+            logging.exception('Can not connect to the broker')
+            self._broker_failed()
+            yield None
+            return
+        with connection:
+            yield connection
+
+    def is_broker_down(self):
+        return time.monotonic() < self.broker_down_until
+
+    def _broker_failed(self):
+        self.broker_down_until = time.monotonic() + self.retry_interval
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _publish(self, task_name, args, kwargs, eta, connection=None):
+        if self.is_broker_down():
+            raise OperationalError('Broker is down')
+        try:
+            app.signature(task_name, args=args, kwargs=kwargs).apply_async(
+                eta=eta, connection=connection, retry=False,
+            )
+        except Exception as error:
+            # a misconfigured broker is as good as a down one
+            self._broker_failed()
+            raise OperationalError(str(error)) from error
+
+    def dispatch(self, task_name, args=(), kwargs=None, eta=None,
+                 connection=None, callback=None):
+        """
+        Publishes the task or puts it to the fallback queue
+        :param callback: called by the fallback thread when a queued task
+        is published or run
+        :return: True if published, False if queued
+        :raises queue.Full: if the fallback queue is full
+        """
+        kwargs = kwargs or {}
+        try:
+            self._publish(task_name, args, kwargs, eta, connection)
+        except OperationalError:
+            self.queue.put_nowait((task_name, args, kwargs, eta, callback))
+            self._count('fallbacks')
+            self._start()
+            return False
+        self._count('published')
+        return True
+
+    def _start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self._run(*item)
+            except Exception:
+                logging.exception("Fallback of task '%s' failed" % item[0])
+                self._count('failed')
+            finally:
+                self.queue.task_done()
+
+    def _run(self, task_name, args, kwargs, eta, callback):
+        for attempt in range(self.retries):
+            try:
+                with self.connection() as connection:
+                    self._publish(task_name, args, kwargs, eta, connection)
+            except OperationalError:
+                time.sleep(self.retry_interval)
+            else:
+                self._count('republished')
+                break
+        else:
+            wait = (eta - timezone.now()).total_seconds() if eta else 0
+            if wait > 0:
+                # it must not run before its eta, e.g. a comment digest
+                if not self.retries:
+                    time.sleep(min(wait, self.retry_interval))
+                try:
+                    self.queue.put_nowait(
+                        (task_name, args, kwargs, eta, callback),
+                    )
+                except queue.Full:
+                    time.sleep(wait)
+                else:
+                    self._count('requeued')
+                    return
+            logging.warning(
+                "Broker is down, running task '%s' here" % task_name,
+            )
+            app.tasks[task_name].apply(args, kwargs)
+            self._count('local')
+        if callback is not None:
+            callback()
+
+    def join(self):
+        """
+        Waits until the fallback queue is empty
+        """
+        self.queue.join()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        stats['broker_down'] = self.is_broker_down()
+        return stats
+
+
+dispatcher = TaskDispatcher()
@@ -0,0 +1,425 @@
+import hashlib
+import io
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.move import file_move_safe
+from django.db import IntegrityError, transaction
+from django.db.models import F, Count, Sum
+from django.utils import timezone
+from PIL import Image
+
+from api.models import ImageDerivative, ImageBlob, UploadedImage, \
+    ImageUploadSession
+from api.storage import images_storage
+
+__all__ = (
+    'get_upload_session_path',
+    'write_chunk',
+    'get_image_metadata',
+    'make_derivatives',
+    'get_content_hash',
+    'acquire_blob',
+    'release_blob',
+    'store_local_file',
+    'create_uploaded_image',
+    'collect_garbage',
+)
+
+
+def get_upload_session_path(session_id):
+    return os.path.join(settings.IMAGE_UPLOAD_SESSIONS_DIR, str(session_id))
+
+
+def write_chunk(path, offset, stream, length):
+    """
+    Writes up to length bytes of stream to the local file at offset
+    :param path: path of the file
+    :param offset: position in file to write from
+    :param stream: file-like object, e.g. request body
+    :param length: bytes to read from stream
+    :return: count of written bytes, less than length if stream broke
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    written = 0
+    try:
+        while written < length:
+            try:
+                chunk = stream.read(
+                    min(settings.IMAGE_UPLOAD_BUFFER_SIZE, length - written)
+                )
+            except OSError:
+                # client is gone, keep what was received to resume from it
+                break
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, offset + written)
+            written += len(chunk)
+    finally:
+        os.close(fd)
+    return written
+
+
+def get_image_metadata(file):
+    """
+    Checks the image and reads what is stored in UploadedImage columns
+    :return: dict of width, height and format or None if it is not an image
+    """
+    try:
+        with Image.open(file) as image:
+            image.verify()
+            return {
+                'width': image.width,
+                'height': image.height,
+                'format': image.format,
+            }
+    except Exception:
+        # Pillow raises different errors for broken and unknown files
+        return None
+    finally:
+        file.seek(0)
+
+
+def _get_derivative_format(image):
+    # transparency is kept in PNG, everything else is recompressed to JPEG
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        return 'PNG', 'RGBA'
+    return 'JPEG', 'L' if image.mode in ('1', 'L') else 'RGB'
+
+
+def _get_missing_widths(owner, width):
+    existing = set(owner.derivatives.values_list('width', flat=True))
+    return sorted((
+        size for size in settings.IMAGE_DERIVATIVE_WIDTHS
+        if size < width and size not in existing
+    ), reverse=True)
+
+
+def make_derivatives(image):
+    """
+    Creates missing derivatives of the image narrower than the original,
+    once per content: they belong to the blob if the image has one
+    :param image: UploadedImage
+    :return: list of created ImageDerivative
+    """
+    derivatives = []
+    owner = image.blob if image.blob_id is not None else image
+    # a duplicate upload finds the derivatives made, the file is not read
+    if image.width is not None and \
+            not _get_missing_widths(owner, image.width):
+        return derivatives
+    with image.img.open('rb') as file, Image.open(file) as source:
+        widths = _get_missing_widths(owner, source.width)
+        if not widths:
+            return derivatives
+
+        format, mode = _get_derivative_format(source)
+        # JPEG is decoded right away at 1/2..1/8 scale not less than needed
+        source.draft(mode, (widths[0], widths[0] * source.height // source.width))
+        current = source.convert(mode)
+        for width in widths:
+            # every size is reduced from the previous, not from the original
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize(
+                (width, height), Image.LANCZOS, reducing_gap=3.0,
+            )
+            content = io.BytesIO()
+            current.save(
+                content, format,
+                quality=settings.IMAGE_DERIVATIVE_QUALITY, optimize=True,
+            )
+            derivative = ImageDerivative(width=width)
+            if image.blob_id is not None:
+                derivative.blob = owner
+            else:
+                derivative.image = owner
+            derivative.img.save(
+                '%sw.%s' % (width, format.lower().replace('jpeg', 'jpg')),
+                ContentFile(content.getvalue()), save=False,
+            )
+            derivatives.append(derivative)
+
+    # a concurrent run may have made the same sizes, they are kept
+    ImageDerivative.objects.bulk_create(derivatives, ignore_conflicts=True)
+    return derivatives
+
+
+def get_content_hash(file):
+    content_hash = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        content_hash.update(chunk)
+    file.seek(0)
+    return content_hash.hexdigest()
+
+
+def acquire_blob(content_hash, size, store):
+    """
+    Returns the blob with the content, referenced once more
+    :param content_hash: sha256 hex digest of the content
+    :param size: size of the content
+    :param store: callable storing the content and returning its storage
+    name, called only if there is no blob with the content yet
+    :return: ImageBlob
+    """
+    while True:
+        with transaction.atomic():
+            referenced = ImageBlob.objects.filter(
+                content_hash=content_hash,
+            ).update(ref_count=F('ref_count') + 1)
+            if referenced:
+                return ImageBlob.objects.get(content_hash=content_hash)
+
+        name = store()
+        try:
+            with transaction.atomic():
+                return ImageBlob.objects.create(
+                    content_hash=content_hash, name=name, size=size,
+                    ref_count=1,
+                )
+        except IntegrityError:
+            # the same content was stored concurrently, reference that one
+            images_storage.delete(name)
+
+
+def release_blob(blob_id):
+    """
+    Drops one reference to the blob, the last one deletes it and its file
+    """
+    with transaction.atomic():
+        # the lock keeps acquire_blob from referencing a deleted blob
+        blob = ImageBlob.objects.select_for_update().filter(id=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            ImageBlob.objects.filter(id=blob_id).update(
+                ref_count=F('ref_count') - 1,
+            )
+            return
+        names = [blob.name] + list(
+            blob.derivatives.values_list('img', flat=True)
+        )
+        blob.delete()
+        _delete_files_on_commit(names)
+
+
+def store_local_file(path, name):
+    """
+    Stores the local file in images_storage; it is moved if the storage
+    is on the local disk, else copied
+    :param path: path of the file
+    :param name: wanted storage name
+    :return: storage name of the file
+    """
+    try:
+        images_storage.path(name)
+    except NotImplementedError:
+        with open(path, 'rb') as file:
+            return images_storage.save(name, File(file))
+    while True:
+        name = images_storage.get_available_name(name)
+        full_path = images_storage.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            file_move_safe(path, full_path)
+        except FileExistsError:
+            # taken after get_available_name, look for another one
+            continue
+        permissions = getattr(images_storage, 'file_permissions_mode', None)
+        if permissions is not None:
+            os.chmod(full_path, permissions)
+        return name.replace('\\', '/')
+
+
+def create_uploaded_image(file, **fields):
+    """
+    Creates UploadedImage, the file is stored only if its content is new
+    :param file: uploaded file, `content_hash` is used if it has one
+    :param fields: other fields of UploadedImage
+    """
+    image = UploadedImage(byte_size=file.size, **fields)
+    content_hash = getattr(file, 'content_hash', None) or \
+        get_content_hash(file)
+    # forms.ImageField has already opened it with Pillow
+    pillow_image = getattr(file, 'image', None)
+    if pillow_image is not None:
+        metadata = {
+            'width': pillow_image.width,
+            'height': pillow_image.height,
+            'format': pillow_image.format,
+        }
+    else:
+        metadata = get_image_metadata(file) or {}
+    for name, value in metadata.items():
+        setattr(image, name, value)
+
+    def store():
+        return image.img.storage.save(
+            image.img.field.generate_filename(image, file.name), file,
+        )
+
+    with transaction.atomic():
+        image.blob = acquire_blob(content_hash, file.size, store)
+        image.img = image.blob.name
+        image.save()
+    return image
+
+
+def _walk(storage, path):
+    dirs, files = storage.listdir(path)
+    for file_name in files:
+        yield os.path.join(path, file_name)
+    for dir_name in dirs:
+        yield from _walk(storage, os.path.join(path, dir_name))
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _get_size(storage, name):
+    try:
+        return storage.size(name)
+    except OSError:
+        return 0
+
+
+def _delete_files_on_commit(names):
+    def delete():
+        for name in names:
+            images_storage.delete(name)
+    transaction.on_commit(delete)
+
+
+def collect_unattached_images(cutoff, batch_size):
+    """
+    Deletes images created before cutoff which no post shows
+    :return: count of deleted images, bytes reclaimed
+    """
+    unattached = UploadedImage.objects.filter(
+        post__isnull=True, product_with_default__isnull=True,
+        date_created__lt=cutoff,
+    )
+    deleted = reclaimed = 0
+    while True:
+        with transaction.atomic():
+            image_ids = list(
+                unattached.values_list('id', flat=True)[:batch_size]
+            )
+            if not image_ids:
+                return deleted, reclaimed
+
+            # blobs losing the last reference are deleted by the signal
+            reclaimed += ImageBlob.objects.filter(
+                images__id__in=image_ids,
+            ).annotate(
+                referenced=Count('images'),
+            ).filter(
+                ref_count__lte=F('referenced'),
+            ).aggregate(size=Sum('size'))['size'] or 0
+            # files of derivatives and images uploaded before deduplication
+            # are not shared, they are deleted here
+            names = list(UploadedImage.objects.filter(
+                id__in=image_ids, blob__isnull=True,
+            ).values_list('img', flat=True)) + list(
+                ImageDerivative.objects.filter(
+                    image_id__in=image_ids,
+                ).values_list('img', flat=True)
+            )
+            reclaimed += sum(_get_size(images_storage, name) for name in names)
+
+            UploadedImage.objects.filter(id__in=image_ids).delete()
+            _delete_files_on_commit(names)
+            deleted += len(image_ids)
+
+
+def collect_stray_files(cutoff, batch_size, upload_dir='uploaded_images'):
+    """
+    Deletes stored files modified before cutoff which no row references
+    :return: count of deleted files, bytes reclaimed
+    """
+    deleted = reclaimed = 0
+    for names in _chunks(_walk(images_storage, upload_dir), batch_size):
+        referenced = set(UploadedImage.objects.filter(
+            img__in=names,
+        ).values_list('img', flat=True))
+        referenced.update(ImageBlob.objects.filter(
+            name__in=names,
+        ).values_list('name', flat=True))
+        referenced.update(ImageDerivative.objects.filter(
+            img__in=names,
+        ).values_list('img', flat=True))
+
+        for name in names:
+            if name in referenced:
+                continue
+            try:
+                # fresh files may belong to a row not committed yet
+                if images_storage.get_modified_time(name) >= cutoff:
+                    continue
+                size = images_storage.size(name)
+                images_storage.delete(name)
+            except (OSError, NotImplementedError):
+                continue
+            deleted += 1
+            reclaimed += size
+    return deleted, reclaimed
+
+
+def collect_upload_sessions(cutoff, batch_size):
+    """
+    Deletes upload sessions created before cutoff and their chunks
+    :return: count of deleted sessions, bytes reclaimed
+    """
+    stale = ImageUploadSession.objects.filter(date_created__lt=cutoff)
+    deleted = reclaimed = 0
+    while True:
+        session_ids = list(stale.values_list('id', flat=True)[:batch_size])
+        if not session_ids:
+            break
+        ImageUploadSession.objects.filter(id__in=session_ids).delete()
+        for session_id in session_ids:
+            path = get_upload_session_path(session_id)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            reclaimed += size
+        deleted += len(session_ids)
+    return deleted, reclaimed
+
+
+def collect_garbage():
+    """
+    Deletes images, files and upload sessions nobody needs in batches
+    :return: dict of deleted counts and bytes reclaimed
+    """
+    now = timezone.now()
+    batch_size = settings.IMAGE_GC_BATCH_SIZE
+    images, images_reclaimed = collect_unattached_images(
+        now - timedelta(seconds=settings.UNATTACHED_IMAGE_TTL), batch_size,
+    )
+    files, files_reclaimed = collect_stray_files(
+        now - timedelta(seconds=settings.STRAY_FILE_TTL), batch_size,
+    )
+    sessions, sessions_reclaimed = collect_upload_sessions(
+        now - timedelta(seconds=settings.IMAGE_UPLOAD_SESSION_TTL), batch_size,
+    )
+    return {
+        'images': images,
+        'files': files,
+        'sessions': sessions,
+        'bytes': images_reclaimed + files_reclaimed + sessions_reclaimed,
+    }
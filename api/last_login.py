@@ -0,0 +1,97 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, When, Value, F, Q, DateTimeField
+from pytz import utc
+
+from api.models import AuthUser
+
+__all__ = (
+    'buffer_last_login',
+    'flush_last_logins',
+)
+
+# logins of a time slot are numbered entries, so a flush can list them
+COUNT_KEY = 'users:last_login:%s:count'
+ENTRY_KEY = 'users:last_login:%s:%s'
+# (slot, index) of the last flushed entry
+FLUSHED_KEY = 'users:last_login:flushed'
+# entries of older slots are dropped if no flush ran for so long
+KEEP_SLOTS = 10
+BATCH_SIZE = 500
+
+
+def _slot(timestamp):
+    return int(timestamp // settings.LAST_LOGIN_FLUSH_INTERVAL)
+
+
+def _timeout():
+    return settings.LAST_LOGIN_FLUSH_INTERVAL * KEEP_SLOTS
+
+
+def buffer_last_login(user_id, timestamp=None):
+    """
+    Remembers the login in the cache, `flush_last_logins` writes it
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    slot = _slot(timestamp)
+    cache.add(COUNT_KEY % slot, 0, _timeout())
+    index = cache.incr(COUNT_KEY % slot)
+    cache.set(ENTRY_KEY % (slot, index), (user_id, timestamp), _timeout())
+
+
+def _read_entries():
+    """
+    Returns {user id: timestamp of the last login} of not flushed entries
+    and the position to flush from next time
+    """
+    current = _slot(time.time())
+    position = cache.get(FLUSHED_KEY)
+    if position is None or position[0] < current - KEEP_SLOTS:
+        position = (current - KEEP_SLOTS, 0)
+    last_logins = {}
+    for slot in range(position[0], current + 1):
+        start = position[1] + 1 if slot == position[0] else 1
+        count = cache.get(COUNT_KEY % slot, 0)
+        keys = [ENTRY_KEY % (slot, index) for index in range(start, count + 1)]
+        entries = cache.get_many(keys)
+        for index, key in enumerate(keys, start):
+            if key not in entries:
+                # numbered, but not written yet: read it next time
+                if slot >= current - 1:
+                    return last_logins, (slot, index - 1)
+                continue
+            user_id, timestamp = entries[key]
+            last_logins[user_id] = max(last_logins.get(user_id, 0), timestamp)
+        position = (slot, count)
+    return last_logins, position
+
+
+def flush_last_logins():
+    """
+    Writes buffered logins to `AuthUser.last_login`, one UPDATE per batch
+    :return: number of users
+    """
+    last_logins, position = _read_entries()
+    user_ids = list(last_logins)
+    for offset in range(0, len(user_ids), BATCH_SIZE):
+        whens = []
+        for user_id in user_ids[offset:offset + BATCH_SIZE]:
+            last_login = datetime.fromtimestamp(last_logins[user_id], utc)
+            # a late flush must not move last_login back
+            whens.append(When(
+                Q(id=user_id) & (
+                    Q(last_login__isnull=True) | Q(last_login__lt=last_login)
+                ),
+                then=Value(last_login),
+            ))
+        AuthUser.objects.filter(
+            id__in=user_ids[offset:offset + BATCH_SIZE],
+        ).update(last_login=Case(
+            *whens, default=F('last_login'), output_field=DateTimeField(),
+        ))
+    cache.set(FLUSHED_KEY, position, None)
+    return len(user_ids)
@@ -1,14 +1,16 @@
+import logging
+
 from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import get_template
 from django.core.mail import send_mail
 from planekstest import settings
 
 
-def _send_email(
+def _build_email(
         subject, template, targets, sender=None, context=None,
 ):
     """
-    Sends email to targets
+    Renders email to targets
     :param subject: The topic of email
     :param template: template name (lookup in 'templaces/emails/%s/.txt|.html')
     :param targets: one address or list of receivers
@@ -28,24 +30,88 @@ def _send_email(
 
     text_content = text_tmp.render(context)
 
-    msg = EmailMultiAlternatives(subject, text_content, sender, targets)
-    msg.send()
+    return EmailMultiAlternatives(subject, text_content, sender, targets)
+
+
+def _send_email(*args, **kwargs):
+    """
+    Sends email to targets, arguments are the same as of _build_email
+    """
+    _build_email(*args, **kwargs).send()
+
+
+def send_emails(messages, connection=None):
+    """
+    Sends messages over one backend connection,
+    failure of a message does not stop the rest
+    :param messages: iterable of EmailMessage
+    :param connection: backend connection, default one if None
+    :return: list of messages which were not sent
+    """
+    if connection is None:
+        connection = get_connection()
+    failed = []
+    # opened connection is not closed by send_messages between messages
+    connection.open()
+    try:
+        for msg in messages:
+            msg.connection = connection
+            try:
+                connection.send_messages([msg])
+            except Exception:
+                logging.exception("Failed to send email to %s" % msg.to)
+                failed.append(msg)
+                # the failure may have broken the connection
+                connection.close()
+                connection.open()
+    finally:
+        connection.close()
+    return failed
 
 
 def send_new_comment(target_email, post_link):
-    _send_email(
-        'You have new comment',
+    send_new_comments(target_email, [(post_link, 1)])
+
+
+def _build_new_comments(target_email, posts):
+    return _build_email(
+        'You have new comments' if len(posts) > 1 or posts[0][1] > 1
+        else 'You have new comment',
         'new_comment',
         target_email,
         context={
-            'post_link': post_link,
-
+            'posts': [
+                {'link': post_link, 'count': count}
+                for post_link, count in posts
+            ],
+            'count': sum(count for _, count in posts),
         }
     )
 
 
-def send_register_email(user, token):
-    _send_email(
+def send_new_comments(target_email, posts):
+    """
+    Sends one digest of new comments
+    :param posts: list of (post link, count of new comments)
+    """
+    _build_new_comments(target_email, posts).send()
+
+
+def send_new_comments_bulk(digests):
+    """
+    Sends digests of new comments over one connection
+    :param digests: iterable of (target email, posts as in send_new_comments)
+    :return: list of target emails which were not sent
+    """
+    failed = send_emails(
+        _build_new_comments(target_email, posts)
+        for target_email, posts in digests
+    )
+    return [msg.to[0] for msg in failed]
+
+
+def _build_register_email(user, token):
+    return _build_email(
         'Your registration on test_task', 'register_email', user.email,
         context={
             'user_email': user.email,
@@ -53,3 +119,19 @@ def send_register_email(user, token):
             'token':  token,  # not implemented: token.get_url(request)
         },
     )
+
+
+def send_register_email(user, token):
+    _build_register_email(user, token).send()
+
+
+def send_register_emails(users, token):
+    """
+    Sends registration emails over one connection
+    :param users: iterable of users
+    :return: list of target emails which were not sent
+    """
+    failed = send_emails(
+        _build_register_email(user, token) for user in users
+    )
+    return [msg.to[0] for msg in failed]
@@ -0,0 +1,95 @@
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.images import get_image_metadata, acquire_blob
+from api.models import UploadedImage
+from api.signals import touch_images_posts
+from api.storage import images_storage
+
+
+def read_stored_image(name):
+    """
+    Reads metadata and hash of the stored file in a worker process
+    :return: dict of UploadedImage fields and `content_hash` or None if
+    there is no such file or it is not an image
+    """
+    try:
+        with images_storage.open(name) as file:
+            content = file.read()
+    except OSError:
+        return None
+    metadata = get_image_metadata(io.BytesIO(content))
+    if metadata is None:
+        return None
+    metadata['byte_size'] = len(content)
+    metadata['content_hash'] = hashlib.sha256(content).hexdigest()
+    return metadata
+
+
+class Command(BaseCommand):
+    help = 'Fills dimensions, format, size and blob of uploaded images ' \
+           'which have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processes reading files, CPU count by default',
+        )
+
+    def handle(self, *args, **options):
+        filled = failed = 0
+        # workers only read files, setup is for platforms spawning them
+        with ProcessPoolExecutor(
+                options['workers'], initializer=django.setup,
+        ) as executor:
+            images = UploadedImage.objects.filter(
+                width__isnull=True,
+            ).only('id', 'img', 'blob').order_by('pk')
+            last_pk = None
+            while True:
+                batch = images
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                batch = list(batch[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+
+                names = [image.img.name for image in batch]
+                results = executor.map(read_stored_image, names)
+                filled_batch = []
+                for image, metadata in zip(batch, results):
+                    if metadata is not None:
+                        self.fill(image, metadata)
+                        filled_batch.append(image)
+                UploadedImage.objects.bulk_update(
+                    filled_batch, ['width', 'height', 'format', 'byte_size'],
+                )
+                touch_images_posts(*(image.id for image in filled_batch))
+                filled += len(filled_batch)
+                failed += len(batch) - len(filled_batch)
+                self.stdout.write('%s filled, %s failed' % (filled, failed))
+
+    @staticmethod
+    def fill(image, metadata):
+        content_hash = metadata.pop('content_hash')
+        for name, value in metadata.items():
+            setattr(image, name, value)
+        if image.blob_id is not None:
+            return
+
+        # images uploaded before deduplication share blobs from now on
+        name = image.img.name
+        with transaction.atomic():
+            blob = acquire_blob(content_hash, image.byte_size, lambda: name)
+            UploadedImage.objects.filter(id=image.id).update(
+                blob=blob, img=blob.name,
+            )
+            if blob.name != name:
+                transaction.on_commit(lambda: images_storage.delete(name))
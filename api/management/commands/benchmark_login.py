@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+from rest_framework_jwt.serializers import JSONWebTokenSerializer
+
+from api.models import AuthUser
+from api.v1.auth.views import LoginView
+
+EMAIL = 'benchmark-login@example.com'
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Measures logins per second of one process (one core); ' \
+           'the benchmark user is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        # the benchmark logs in far more often than the throttle allows
+        view = LoginView.as_view(throttle_classes=())
+        data = {'email': EMAIL, 'password': PASSWORD}
+
+        def login():
+            response = view(factory.post('/', data, format='json'))
+            assert response.status_code == 200, response.data
+
+        def two_pass_login():
+            # the former view validated the credentials before the login
+            JSONWebTokenSerializer(data=data).is_valid(raise_exception=True)
+            login()
+
+        with transaction.atomic():
+            AuthUser.objects.create_user(EMAIL, PASSWORD)
+            for name, func in (
+                    ('two-pass', two_pass_login),
+                    ('single-pass', login),
+            ):
+                func()  # warm up
+                start = time.perf_counter()
+                for i in range(options['count']):
+                    func()
+                elapsed = time.perf_counter() - start
+                self.stdout.write('%s: %.1f logins/sec' % (
+                    name, options['count'] / elapsed,
+                ))
+            transaction.set_rollback(True)
@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import AuthUser, AuthUserType, AuthUserRegistrationType
+from api.outbox import enqueue_task
+from api.v1.auth.views import VERIFICATION_TOKEN
+from planekstest.tasks import send_verification_emails
+
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield row
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+class Command(BaseCommand):
+    help = 'Creates users from CSV or NDJSON with email, password, ' \
+           'first_name, last_name and reg_type; existing emails are skipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file to import, - for stdin')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='by the file extension if not set',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processes hashing passwords, CPU count by default',
+        )
+        parser.add_argument(
+            '--send-verification', action='store_true',
+            help='send verification emails to the created users',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='file with the count of imported records, the import '
+                 'resumes from it; PATH.checkpoint by default',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        data_format = options['format'] or os.path.splitext(path)[1][1:]
+        if data_format not in READERS:
+            raise CommandError('Unknown format, use --format')
+        checkpoint = options['checkpoint']
+        if checkpoint is None and path != '-':
+            checkpoint = path + '.checkpoint'
+
+        self.workers = options['workers'] or os.cpu_count()
+        done = self.read_checkpoint(checkpoint)
+        created = skipped = 0
+        if path == '-':
+            file = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        else:
+            file = open(path, newline='', encoding='utf-8')
+        # workers only hash, setup is for platforms spawning them
+        with file, ProcessPoolExecutor(
+                self.workers, initializer=django.setup,
+        ) as executor:
+            records = islice(READERS[data_format](file), done, None)
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    user_ids = self.create_users(batch, executor, options)
+                done += len(batch)
+                created += len(user_ids)
+                skipped += len(batch) - len(user_ids)
+                # written after commit: a crash repeats at most one batch,
+                # whose users are skipped as existing then
+                self.write_checkpoint(checkpoint, done)
+                self.stdout.write('%s read, %s created, %s skipped' % (
+                    done, created, skipped,
+                ))
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def create_users(self, batch, executor, options):
+        records = {}
+        for record in batch:
+            email = AuthUser.objects.normalize_email(record.get('email'))
+            if email and email not in records:
+                records[email] = record
+        existing = set(AuthUser.objects.filter(
+            email__in=records,
+        ).values_list('email', flat=True))
+        records = [
+            (email, record) for email, record in records.items()
+            if email not in existing
+        ]
+        if not records:
+            return []
+
+        # password hashing is the most of the import
+        passwords = executor.map(
+            make_password,
+            [record.get('password') or None for _, record in records],
+            chunksize=max(1, len(records) // (self.workers * 4)),
+        )
+        users = [
+            AuthUser(
+                email=email,
+                password=password,
+                first_name=record.get('first_name') or '',
+                last_name=record.get('last_name') or '',
+                user_type=AuthUserType.client,
+                reg_type=self.get_reg_type(record.get('reg_type')),
+            )
+            for (email, record), password in zip(records, passwords)
+        ]
+        # an email registered meanwhile is skipped, not an error
+        AuthUser.objects.bulk_create(users, ignore_conflicts=True)
+        # salted hashes tell our rows from the ones of other writers;
+        # not every database returns ids from bulk_create
+        passwords = {user.email: user.password for user in users}
+        user_ids = [
+            user_id for user_id, email, password in AuthUser.objects.filter(
+                email__in=passwords,
+            ).values_list('id', 'email', 'password')
+            if passwords[email] == password
+        ]
+
+        if options['send_verification'] and user_ids:
+            # one task sends the emails of the batch over one connection
+            enqueue_task(
+                send_verification_emails, (user_ids, VERIFICATION_TOKEN),
+            )
+        return user_ids
+
+    @staticmethod
+    def get_reg_type(reg_type):
+        if reg_type == AuthUserRegistrationType.redactor:
+            return reg_type
+        return AuthUserRegistrationType.default
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        if checkpoint is None or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as file:
+            return json.load(file)['records']
+
+    @staticmethod
+    def write_checkpoint(checkpoint, records):
+        if checkpoint is None:
+            return
+        # replaced at once, a crash never leaves a broken checkpoint
+        with open(checkpoint + '.tmp', 'w') as file:
+            json.dump({'records': records}, file)
+        os.replace(checkpoint + '.tmp', checkpoint)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Post, Comment, UploadedImage
+from api.signals import touch_posts
+
+
+def _count(model):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            post_id=OuterRef('id'),
+        ).order_by().values('post_id').annotate(
+            count=Count('id'),
+        ).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Repairs comment and image counters of posts which have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            post_ids = list(Post.objects.filter(
+                id__gt=last_id,
+            ).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not post_ids:
+                break
+            last_id = post_ids[-1]
+
+            drifted = list(Post.objects.filter(id__in=post_ids).annotate(
+                real_comment_count=_count(Comment),
+                real_image_count=_count(UploadedImage),
+            ).filter(
+                ~Q(comment_count=F('real_comment_count')) |
+                ~Q(image_count=F('real_image_count'))
+            ).values_list('id', flat=True))
+            if drifted:
+                # counted in the UPDATE itself, changes made meanwhile count
+                Post.objects.filter(id__in=drifted).update(
+                    comment_count=_count(Comment),
+                    image_count=_count(UploadedImage),
+                )
+                touch_posts(*drifted)
+
+            checked += len(post_ids)
+            repaired += len(drifted)
+            self.stdout.write('%s checked, %s repaired' % (checked, repaired))
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.dispatch import dispatcher
+from api.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = 'Dispatches tasks of the outbox to celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TASK_OUTBOX_BATCH_SIZE,
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            default=settings.TASK_OUTBOX_POLL_INTERVAL,
+            help='seconds to wait when the outbox is empty',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='exit when outbox is empty and fallback queue is done',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            dispatched = relay_outbox(batch_size)
+            if dispatched:
+                self.stdout.write('%s tasks dispatched' % dispatched)
+            if dispatcher.is_broker_down():
+                self.stderr.write(
+                    'Broker is down: %(queued)s tasks queued, '
+                    '%(fallbacks)s fallbacks, %(local)s run locally'
+                    % dispatcher.get_stats()
+                )
+            # a full batch means more is waiting
+            if dispatched < batch_size:
+                if options['once']:
+                    dispatcher.join()
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,92 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.models import UploadedImage, ImageDerivative, ImageBlob, \
+    get_sharded_name
+from api.signals import touch_images_posts
+from api.storage import images_storage
+
+
+def move_file(name):
+    """
+    Moves the stored file to its sharded name, safe to repeat after a failure
+    :return: new name of the file
+    """
+    upload_dir, file_name = os.path.split(name)
+    new_name = get_sharded_name(upload_dir, file_name)
+    if not images_storage.exists(name):
+        # moved by a failed run, or a file shared by several rows
+        return new_name
+
+    try:
+        path = images_storage.path(name)
+    except NotImplementedError:
+        # remote storages can only copy
+        if not images_storage.exists(new_name):
+            with images_storage.open(name) as file:
+                images_storage.save(new_name, file)
+        images_storage.delete(name)
+        return new_name
+
+    new_path = images_storage.path(new_name)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(path, new_path)
+    return new_name
+
+
+class Command(BaseCommand):
+    help = 'Moves uploaded images from flat directories to sharded ones'
+
+    # model, file name field, directory the field is uploaded to
+    targets = (
+        (UploadedImage, 'img', 'uploaded_images'),
+        (ImageBlob, 'name', 'uploaded_images'),
+        (ImageDerivative, 'img', 'uploaded_images/derivatives'),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='Files moved in parallel',
+        )
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(options['workers']) as executor:
+            for model, field, upload_dir in self.targets:
+                moved = self.shard(
+                    model, field, upload_dir, options['batch_size'], executor,
+                )
+                self.stdout.write('%s %s moved' % (
+                    moved, model._meta.verbose_name_plural,
+                ))
+
+    def shard(self, model, field, upload_dir, batch_size, executor):
+        flat = model.objects.filter(**{
+            '%s__regex' % field: r'^%s/[^/]+$' % re.escape(upload_dir),
+        }).order_by('pk')
+        moved = 0
+        while True:
+            batch = list(flat[:batch_size])
+            if not batch:
+                return moved
+
+            names = list({str(getattr(instance, field)) for instance in batch})
+            new_names = dict(zip(names, executor.map(move_file, names)))
+            for instance in batch:
+                setattr(
+                    instance, field, new_names[str(getattr(instance, field))],
+                )
+            model.objects.bulk_update(batch, [field])
+            # image urls are cached in post responses
+            touch_images_posts(*(
+                getattr(instance, 'image_id', instance.pk) for instance in batch
+                if not isinstance(instance, ImageBlob)
+            ))
+            moved += len(batch)
+            self.stdout.write('%s %s moved' % (
+                moved, model._meta.verbose_name_plural,
+            ))
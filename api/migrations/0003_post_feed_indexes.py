@@ -0,0 +1,31 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:25
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_date_published(apps, schema_editor):
+    # approved posts are paged by date_published, so it can't be null
+    Post = apps.get_model('api', 'Post')
+    Post.objects.filter(
+        review_status=2, date_published__isnull=True,
+    ).update(date_published=F('date_created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_auto_20191118_1420'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_date_published, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['review_status', '-date_published', '-id'], name='post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_by', '-date_created', '-id'], name='post_own_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:02
+
+from django.db import migrations
+from django.db.models import F
+
+
+def fill_date_modified(apps, schema_editor):
+    # date_modified was never written before, it is Last-Modified now
+    Post = apps.get_model('api', 'Post')
+    Post.objects.filter(
+        date_modified__isnull=True,
+    ).update(date_modified=F('date_created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_post_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_date_modified, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+def fill_canonical_name(apps, schema_editor):
+    """
+    Tags differing only by case are merged into the oldest one
+    """
+    Tag = apps.get_model('api', 'Tag')
+    Post = apps.get_model('api', 'Post')
+    PostTag = Post.tags.through
+
+    kept = {}
+    for tag in Tag.objects.order_by('id').iterator():
+        canonical_name = tag.name.lower()
+        if canonical_name not in kept:
+            tag.canonical_name = canonical_name
+            tag.save(update_fields=['canonical_name'])
+            kept[canonical_name] = tag.id
+            continue
+
+        kept_id = kept[canonical_name]
+        tagged = PostTag.objects.filter(tag_id=kept_id).values('post_id')
+        PostTag.objects.filter(tag_id=tag.id).exclude(
+            post_id__in=tagged,
+        ).update(tag_id=kept_id)
+        tag.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_post_date_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='canonical_name',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.RunPython(fill_canonical_name, migrations.RunPython.noop),
+    ]
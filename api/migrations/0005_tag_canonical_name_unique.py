@@ -0,0 +1,21 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # separate from the data migration: on PostgreSQL the deferred
+    # constraint checks of the merged tags fail ALTER TABLE in the same
+    # transaction with "pending trigger events"
+
+    dependencies = [
+        ('api', '0005_tag_canonical_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='canonical_name',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:38
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_image_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField()),
+                ('img', models.ImageField(upload_to=api.models.derivative_upload_to)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='api.UploadedImage')),
+            ],
+            options={
+                'verbose_name': 'image derivative',
+                'verbose_name_plural': 'image derivatives',
+                'db_table': 'image_derivative',
+                'ordering': ['width'],
+                'unique_together': {('image', 'width')},
+            },
+        ),
+    ]
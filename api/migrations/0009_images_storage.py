@@ -0,0 +1,25 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:43
+
+import api.models
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_image_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagederivative',
+            name='img',
+            field=models.ImageField(storage=api.storage.ImagesStorage(), upload_to=api.models.derivative_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='img',
+            field=models.ImageField(storage=api.storage.ImagesStorage(), upload_to=api.models.image_upload_to, verbose_name='Image'),
+        ),
+    ]
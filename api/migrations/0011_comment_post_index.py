@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'date_created', 'id'], name='comment_post_idx'),
+        ),
+    ]
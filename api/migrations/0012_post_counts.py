@@ -0,0 +1,48 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            post_id=OuterRef('id'),
+        ).order_by().values('post_id').annotate(
+            count=Count('id'),
+        ).values('count')
+    ), 0)
+
+
+def fill_counts(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Post.objects.update(
+        comment_count=_count(apps.get_model('api', 'Comment')),
+        image_count=_count(apps.get_model('api', 'UploadedImage')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_comment_post_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['review_status', '-comment_count', '-date_published', '-id'], name='post_feed_comments_idx'),
+        ),
+    ]
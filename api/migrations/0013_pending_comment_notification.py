@@ -0,0 +1,27 @@
+# Generated by Django 2.2.7 on 2026-10-17 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_post_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCommentNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(db_index=True, max_length=75)),
+                ('post_link', models.CharField(max_length=255)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'pending comment notification',
+                'verbose_name_plural': 'pending comment notifications',
+                'db_table': 'pending_comment_notification',
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:03
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def normalize_emails(apps, schema_editor):
+    """
+    Lowercases emails in batches, each batch in its own transaction.
+    An email whose lowercase is taken by another user is left as is,
+    accounts are not merged
+    """
+    AuthUser = apps.get_model('api', 'AuthUser')
+    last_id = 0
+    while True:
+        users = list(AuthUser.objects.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', 'email')[:BATCH_SIZE])
+        if not users:
+            break
+        last_id = users[-1][0]
+        changed = {
+            user_id: email.strip().lower() for user_id, email in users
+            if email != email.strip().lower()
+        }
+        if not changed:
+            continue
+        with transaction.atomic():
+            taken = set(AuthUser.objects.filter(
+                email__in=changed.values(),
+            ).values_list('email', flat=True))
+            for user_id, email in changed.items():
+                if email not in taken:
+                    AuthUser.objects.filter(id=user_id).update(email=email)
+                    taken.add(email)
+
+
+class Migration(migrations.Migration):
+    # batches are committed one by one
+    atomic = False
+
+    dependencies = [
+        ('api', '0014_task_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_task_outbox_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagederivative',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='api.ImageBlob'),
+        ),
+        migrations.AlterField(
+            model_name='imagederivative',
+            name='image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='api.UploadedImage'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagederivative',
+            unique_together={('blob', 'width'), ('image', 'width')},
+        ),
+    ]
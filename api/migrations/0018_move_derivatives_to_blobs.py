@@ -0,0 +1,38 @@
+# Generated by Django 2.2.7 on 2026-10-17 18:36
+
+from django.db import migrations
+
+
+def move_derivatives_to_blobs(apps, schema_editor):
+    """
+    Derivatives of images with a blob become derivatives of the blob, one
+    per width; files of the dropped ones are left to the stray files GC
+    """
+    ImageDerivative = apps.get_model('api', 'ImageDerivative')
+    derivatives = ImageDerivative.objects.filter(
+        image__blob__isnull=False,
+    ).order_by('id').values_list('id', 'image__blob_id', 'width')
+    kept = set()
+    dropped = []
+    for derivative_id, blob_id, width in list(derivatives):
+        if (blob_id, width) in kept:
+            dropped.append(derivative_id)
+            continue
+        kept.add((blob_id, width))
+        ImageDerivative.objects.filter(id=derivative_id).update(
+            blob_id=blob_id, image_id=None,
+        )
+    ImageDerivative.objects.filter(id__in=dropped).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_image_derivative_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            move_derivatives_to_blobs, migrations.RunPython.noop,
+        ),
+    ]
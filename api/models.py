@@ -1,21 +1,38 @@
+import hashlib
 import os
 import uuid
 
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.db import models
+from django.db.models import F
 from django.urls import reverse
+from django.utils import timezone
 from werkzeug.utils import secure_filename
 
+from api.storage import images_storage
+
 
 class AuthUserManager(BaseUserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        """
+        Emails are stored lowercase, so lookups use the unique index
+        """
+        return (email or '').strip().lower()
+
+    def get_by_natural_key(self, username):
+        return self.get(**{
+            self.model.USERNAME_FIELD: self.normalize_email(username),
+        })
+
     def _create_user(
             self, email, password, user_type, reg_type=None, **extra_fields
     ):
         if not email:
             raise ValueError('The Email must be set')
         user = self.model(
-            email=email, user_type=user_type,
+            email=self.normalize_email(email), user_type=user_type,
             reg_type=reg_type, **extra_fields
         )
         if password:
@@ -53,7 +70,8 @@ class AuthUserManager(BaseUserManager):
         if not password:
             raise ValueError('Cannot create super user without password')
         user = self.model(
-            email=email, user_type=AuthUserType.system, **extra_fields
+            email=self.normalize_email(email), user_type=AuthUserType.system,
+            **extra_fields
         )
         if password:
             user.set_password(password)
@@ -124,17 +142,64 @@ class AuthUser(AbstractBaseUser, PermissionsMixin):
 
     def save(self, *args, **kwargs):
         if self.email is not None:
-            self.email = self.email.lower()
+            self.email = AuthUser.objects.normalize_email(self.email)
         if self.user_type == AuthUserType.system:
             self.is_superuser = True
             self.reg_type = None
         return super(AuthUser, self).save(*args, **kwargs)
 
 
+class TagManager(models.Manager):
+    def resolve(self, names):
+        """
+        Returns tags for names matching them case-insensitively and creates
+        missing ones. Costs at most 3 queries whatever the number of names,
+        concurrent creates of the same tag don't fail.
+        """
+        names_by_canonical = {}
+        for name in names:
+            names_by_canonical.setdefault(Tag.canonicalize(name), name)
+        if not names_by_canonical:
+            return []
+
+        tags = {
+            tag.canonical_name: tag for tag in self.filter(
+                canonical_name__in=names_by_canonical,
+            )
+        }
+        missing = [
+            canonical for canonical in names_by_canonical
+            if canonical not in tags
+        ]
+        if missing:
+            self.bulk_create(
+                [
+                    Tag(
+                        name=names_by_canonical[canonical],
+                        canonical_name=canonical,
+                    )
+                    for canonical in missing
+                ],
+                ignore_conflicts=True,
+            )
+            # ids are not returned by bulk_create with ignore_conflicts
+            tags.update(
+                (tag.canonical_name, tag)
+                for tag in self.filter(canonical_name__in=missing)
+            )
+        return [tags[canonical] for canonical in names_by_canonical]
+
+
 class Tag(models.Model):
     name = models.CharField(
         max_length=20, unique=True,
     )
+    # lowercased name, tags are matched case-insensitively by it
+    canonical_name = models.CharField(
+        max_length=20, unique=True,
+    )
+
+    objects = TagManager()
 
     class Meta:
         db_table = 'tag'
@@ -145,6 +210,14 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def canonicalize(name):
+        return name.lower()
+
+    def save(self, *args, **kwargs):
+        self.canonical_name = self.canonicalize(self.name)
+        return super(Tag, self).save(*args, **kwargs)
+
 
 class PostReviewStatus:
     not_applied = 0
@@ -153,6 +226,18 @@ class PostReviewStatus:
     declined = 3
 
 
+class PostManager(models.Manager):
+    def add_counts(self, post_id, comments=0, images=0):
+        """
+        Changes counters of the post with one UPDATE, so concurrent changes
+        are not lost
+        """
+        return self.filter(id=post_id).update(
+            comment_count=F('comment_count') + comments,
+            image_count=F('image_count') + images,
+        )
+
+
 class Post(models.Model):
     POST_REVIEW_CHOICES = [
         (PostReviewStatus.not_applied, 'not_applied'),
@@ -194,18 +279,65 @@ class Post(models.Model):
     date_published = models.DateTimeField(null=True)
     date_modified = models.DateTimeField(null=True)
 
+    # changed by PostManager.add_counts only, repaired by reconcile_post_counts
+    comment_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+    COUNTER_FIELDS = ('comment_count', 'image_count')
+
+    objects = PostManager()
+
     def get_url(self, request):
         return request.build_absolute_uri(
             reverse('api_v1:post-details', kwargs={'id': self.id})
         )
+
     class Meta:
         db_table = 'post'
         verbose_name = 'post'
         verbose_name_plural = 'posts'
+        indexes = [
+            # keyset pagination of the public feed and of own posts
+            models.Index(
+                fields=['review_status', '-date_published', '-id'],
+                name='post_feed_idx',
+            ),
+            models.Index(
+                fields=['created_by', '-date_created', '-id'],
+                name='post_own_idx',
+            ),
+            models.Index(
+                fields=[
+                    'review_status', '-comment_count', '-date_published', '-id',
+                ],
+                name='post_feed_comments_idx',
+            ),
+        ]
 
     def __str__(self):
         return "%s" % self.title
 
+    def save(self, *args, **kwargs):
+        now = timezone.now()
+        # approved posts are ordered by date_published, it must be set
+        if self.review_status == PostReviewStatus.approved and \
+                self.date_published is None:
+            self.date_published = now
+        # changes of images, tags and comments update it too (api.signals)
+        self.date_modified = now
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # a stale copy must not overwrite counters changed meanwhile
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.COUNTER_FIELDS
+            ]
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'date_published', 'date_modified',
+            }
+        return super(Post, self).save(*args, **kwargs)
+
 
 class Comment(models.Model):
     name = models.CharField(max_length=42)
@@ -216,22 +348,89 @@ class Comment(models.Model):
     )
     date_created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # comments of a post are paged by (date_created, id)
+            models.Index(
+                fields=['post', 'date_created', 'id'], name='comment_post_idx',
+            ),
+        ]
+
     def __unicode__(self):
         return self.text
 
 
+class PendingCommentNotification(models.Model):
+    """
+    New comment notification waiting to be sent in a digest
+    """
+    recipient = models.EmailField(max_length=75, db_index=True)
+    post_link = models.CharField(max_length=255)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'pending_comment_notification'
+        verbose_name = 'pending comment notification'
+        verbose_name_plural = 'pending comment notifications'
+
+
+class TaskOutbox(models.Model):
+    """
+    Celery task written in the transaction of its data,
+    published by the relay_task_outbox command after the commit
+    """
+    task_name = models.CharField(max_length=255)
+    args = models.TextField(default='[]')  # JSON
+    kwargs = models.TextField(default='{}')  # JSON
+    eta = models.DateTimeField(null=True, blank=True)
+    # set while the task waits in the fallback queue of a relay,
+    # the task is dispatched again if it is not done by then
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'task_outbox'
+        verbose_name = 'outbox task'
+        verbose_name_plural = 'outbox tasks'
+
+
+def get_sharded_name(upload_dir, file_name):
+    """
+    Returns `upload_dir/ab/cd/file_name`, where `abcd` starts the name hash,
+    so no directory holds too many files
+    """
+    digest = hashlib.md5(file_name.encode('utf-8')).hexdigest()
+    return os.path.join(upload_dir, digest[:2], digest[2:4], file_name)
+
+
 def _get_filename_in_dir(upload_dir, filename):
     filename, file_extension = os.path.splitext(filename)
     file_name = str(uuid.uuid4()) + '_' + secure_filename(filename)
     if file_extension is not None and len(file_extension) > 0:
         file_name += file_extension
-    return os.path.join(upload_dir, file_name)
+    return get_sharded_name(upload_dir, file_name)
 
 
 def image_upload_to(instance, filename):
     return _get_filename_in_dir('uploaded_images', filename)
 
 
+class ImageBlob(models.Model):
+    """
+    Stored image content, shared by uploaded images with the same bytes
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'image_blob'
+        verbose_name = 'image blob'
+        verbose_name_plural = 'image blobs'
+
+
 class UploadedImage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     uploaded_by = models.ForeignKey(
@@ -241,7 +440,19 @@ class UploadedImage(models.Model):
         'Post', null=True, blank=True,
         on_delete=models.CASCADE, related_name='images'
     )
-    img = models.ImageField(upload_to=image_upload_to, verbose_name='Image')
+    img = models.ImageField(
+        upload_to=image_upload_to, storage=images_storage, verbose_name='Image'
+    )
+    # read once on upload, so no file is opened to get them
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    format = models.CharField(max_length=10, blank=True)
+    byte_size = models.BigIntegerField(null=True, blank=True)
+    # null for images uploaded before deduplication
+    blob = models.ForeignKey(
+        'ImageBlob', null=True, blank=True, on_delete=models.PROTECT,
+        related_name='images'
+    )
     date_created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -249,3 +460,54 @@ class UploadedImage(models.Model):
         verbose_name = 'uploaded image'
         verbose_name_plural = 'uploaded images'
         ordering = ['date_created']
+
+
+def derivative_upload_to(instance, filename):
+    return _get_filename_in_dir('uploaded_images/derivatives', filename)
+
+
+class ImageDerivative(models.Model):
+    """
+    Downscaled and recompressed copy of a stored image, made once per
+    content: images with a blob share derivatives of the blob
+    """
+    blob = models.ForeignKey(
+        'ImageBlob', null=True, blank=True,
+        on_delete=models.CASCADE, related_name='derivatives'
+    )
+    # only for images uploaded before deduplication, they have no blob
+    image = models.ForeignKey(
+        'UploadedImage', null=True, blank=True,
+        on_delete=models.CASCADE, related_name='derivatives'
+    )
+    width = models.PositiveIntegerField()
+    img = models.ImageField(
+        upload_to=derivative_upload_to, storage=images_storage
+    )
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'image_derivative'
+        verbose_name = 'image derivative'
+        verbose_name_plural = 'image derivatives'
+        ordering = ['width']
+        unique_together = (('blob', 'width'), ('image', 'width'))
+
+
+class ImageUploadSession(models.Model):
+    """
+    Resumable upload, chunks are written to
+    `IMAGE_UPLOAD_SESSIONS_DIR/<id>`, on finalize the file is moved to
+    `file_name` of the images storage and becomes an `UploadedImage`
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey('AuthUser', on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'image_upload_session'
+        verbose_name = 'image upload session'
+        verbose_name_plural = 'image upload sessions'
@@ -0,0 +1,99 @@
+import json
+import queue
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.dispatch import dispatcher
+from api.models import TaskOutbox
+
+__all__ = (
+    'enqueue_task',
+    'enqueue_tasks',
+    'relay_outbox',
+)
+
+
+def enqueue_task(task, args=(), kwargs=None, countdown=None):
+    """
+    Writes the task to the outbox in the current transaction,
+    so it is published only if and after the transaction commits
+    :param task: celery task
+    :param args: positional arguments of the task, JSON serializable
+    :param kwargs: keyword arguments of the task, JSON serializable
+    :param countdown: seconds to delay the task for, counted from now
+    """
+    TaskOutbox.objects.create(
+        task_name=task.name,
+        args=json.dumps(list(args)),
+        kwargs=json.dumps(kwargs or {}),
+        eta=timezone.now() + timedelta(seconds=countdown)
+        if countdown else None,
+    )
+
+
+def enqueue_tasks(task, args_list):
+    """
+    Writes one task per item of args_list to the outbox in one INSERT
+    """
+    TaskOutbox.objects.bulk_create([
+        TaskOutbox(task_name=task.name, args=json.dumps(list(args)))
+        for args in args_list
+    ])
+
+
+def _delete_task(task_id):
+    # called by fallback threads, which keep their own connections
+    close_old_connections()
+    TaskOutbox.objects.filter(id=task_id).delete()
+
+
+def relay_outbox(batch_size=None):
+    """
+    Dispatches the oldest batch of the outbox over one broker connection.
+    Published tasks are deleted; tasks put to the fallback queue of the
+    dispatcher while the broker is down are claimed and deleted once they
+    are published or run, so a task may run twice but is never lost
+    :return: number of dispatched tasks
+    """
+    if batch_size is None:
+        batch_size = settings.TASK_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        # concurrent relays take different batches
+        tasks = list(TaskOutbox.objects.select_for_update(
+            skip_locked=True,
+        ).filter(
+            Q(claimed_until__isnull=True) | Q(claimed_until__lt=now),
+        ).order_by('id')[:batch_size])
+        if not tasks:
+            return 0
+        published = []
+        queued = []
+        with dispatcher.connection() as connection:
+            for task in tasks:
+                try:
+                    is_published = dispatcher.dispatch(
+                        task.task_name,
+                        args=json.loads(task.args),
+                        kwargs=json.loads(task.kwargs),
+                        eta=task.eta,
+                        connection=connection,
+                        callback=partial(_delete_task, task.id),
+                    )
+                except queue.Full:
+                    break
+                (published if is_published else queued).append(task)
+        TaskOutbox.objects.filter(id__in=[task.id for task in published]) \
+            .delete()
+        claim_timeout = timedelta(
+            seconds=settings.TASK_FALLBACK_CLAIM_TIMEOUT,
+        )
+        for task in queued:
+            task.claimed_until = max(now, task.eta or now) + claim_timeout
+        TaskOutbox.objects.bulk_update(queued, ['claimed_until'])
+    return len(published) + len(queued)
@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, m2m_changed, \
+    pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import bump_feed_generation, bump_feed_comments_generation, \
+    bump_post_versions, bump_user_version
+from api.images import release_blob
+from api.last_login import buffer_last_login
+from api.models import Post, UploadedImage, Tag, Comment, AuthUser, \
+    PostReviewStatus
+from api.outbox import enqueue_task
+from planekstest.tasks import generate_image_derivatives
+
+
+def touch_posts(*post_ids):
+    """
+    Marks posts as modified when their related objects change
+    """
+    post_ids = [post_id for post_id in post_ids if post_id is not None]
+    if post_ids:
+        Post.objects.filter(id__in=post_ids).update(
+            date_modified=timezone.now(),
+        )
+        bump_post_versions(*post_ids)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    bump_post_versions(instance.id)
+    bump_feed_generation()
+
+
+def touch_image_posts(image):
+    """
+    Marks posts showing the image as modified
+    """
+    post_ids = list(
+        Post.objects.filter(
+            default_image_id=image.id,
+        ).values_list('id', flat=True)
+    )
+    if image.post_id is None and not post_ids:
+        # not shown anywhere, e.g. not attached yet
+        return
+    touch_posts(image.post_id, *post_ids)
+    bump_feed_generation()
+
+
+def touch_images_posts(*image_ids):
+    """
+    Marks posts showing any of the images as modified
+    """
+    if not image_ids:
+        return
+    touch_posts(*Post.objects.filter(
+        Q(images__id__in=image_ids) | Q(default_image_id__in=image_ids)
+    ).values_list('id', flat=True).distinct())
+    bump_feed_generation()
+
+
+@receiver(post_save, sender=UploadedImage)
+@receiver(post_delete, sender=UploadedImage)
+def invalidate_image(sender, instance, **kwargs):
+    touch_image_posts(instance)
+
+
+@receiver(post_delete, sender=UploadedImage)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=UploadedImage)
+def schedule_image_derivatives(sender, instance, created, **kwargs):
+    if created:
+        enqueue_task(generate_image_derivatives, (str(instance.id),))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def invalidate_tag(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    touch_posts(*instance.post_set.values_list('id', flat=True))
+    bump_feed_generation()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        touch_posts(instance.id)
+    elif action in ('post_add', 'post_remove'):
+        touch_posts(*pk_set)
+    elif action == 'pre_clear' and reverse:
+        # pk_set of clear is empty, collect posts of the tag before it
+        touch_posts(*instance.post_set.values_list('id', flat=True))
+    else:
+        return
+    bump_feed_generation()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    touch_posts(instance.post_id)
+    # the public feed shows approved posts only; pages in date order
+    # keep stale comment counts until they expire
+    if Post.objects.filter(
+        id=instance.post_id, review_status=PostReviewStatus.approved,
+    ).exists():
+        bump_feed_comments_generation()
+
+
+@receiver(post_save, sender=AuthUser)
+@receiver(post_delete, sender=AuthUser)
+def invalidate_user(sender, instance, update_fields=None, **kwargs):
+    # last_login is not cached, logins must not drop the cache
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    bump_user_version(instance.id)
+
+
+def buffer_user_login(sender, request, user, **kwargs):
+    """
+    Replaces `update_last_login` of django.contrib.auth:
+    last_login is written to the database by a periodic flush
+    """
+    if not settings.LAST_LOGIN_BUFFERED:
+        update_last_login(sender, user)
+        return
+    user.last_login = timezone.now()
+    buffer_last_login(user.id, user.last_login.timestamp())
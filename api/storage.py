@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.deconstruct import deconstructible
+
+__all__ = (
+    'ImagesStorage',
+    'images_storage',
+)
+
+
+@deconstructible
+class ImagesStorage:
+    """
+    Storage of uploaded images, its class is set by
+    `UPLOADED_IMAGES_STORAGE` (`DEFAULT_FILE_STORAGE` if it is None).
+    Not a LazyObject: migrations would freeze the class chosen by settings.
+    """
+
+    def __init__(self):
+        self._wrapped = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_wrapped':
+            raise AttributeError(name)
+        if self._wrapped is None:
+            self._wrapped = get_storage_class(
+                settings.UPLOADED_IMAGES_STORAGE,
+            )()
+        return getattr(self._wrapped, name)
+
+    def reset(self):
+        self._wrapped = None
+
+
+images_storage = ImagesStorage()
+
+
+@receiver(setting_changed)
+def reset_images_storage(setting, **kwargs):
+    if setting in ('UPLOADED_IMAGES_STORAGE', 'DEFAULT_FILE_STORAGE'):
+        images_storage.reset()
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, \
+    TemporaryFileUploadHandler
+
+__all__ = (
+    'ContentHashMemoryFileUploadHandler',
+    'ContentHashTemporaryFileUploadHandler',
+)
+
+
+class ContentHashMixin:
+    """
+    Hashes uploaded files while they stream in, the hash is set to
+    `content_hash` of the uploaded file
+    """
+
+    def new_file(self, *args, **kwargs):
+        # set before super(), memory handler stops others from there
+        self.content_hash = hashlib.sha256()
+        super(ContentHashMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.keeps_data():
+            self.content_hash.update(raw_data)
+        return super(ContentHashMixin, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super(ContentHashMixin, self).file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.content_hash.hexdigest()
+        return file
+
+    def keeps_data(self):
+        return True
+
+
+class ContentHashMemoryFileUploadHandler(
+        ContentHashMixin, MemoryFileUploadHandler):
+
+    def keeps_data(self):
+        # if not activated chunks pass to the next handler which hashes them
+        return self.activated
+
+
+class ContentHashTemporaryFileUploadHandler(
+        ContentHashMixin, TemporaryFileUploadHandler):
+    pass
@@ -46,8 +46,8 @@ class RegistrationSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def validate_email(email):
-        user = AuthUser.objects.filter(email__iexact=email).first()
-        if user is not None:
+        email = AuthUser.objects.normalize_email(email)
+        if AuthUser.objects.filter(email=email).exists():
             raise ValidationError(
                 'User with this email already exists. '
                 'Try to login or restore password.'
@@ -1,17 +1,43 @@
 # coding=UTF-8
+import io
+import json
+import os
+import shutil
+import tempfile
+import uuid
 from datetime import datetime, timedelta
+from unittest import mock
 
+import redis
+from django.conf import settings
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from freezegun import freeze_time
-from rest_framework.test import APIClient
+from pytz import utc
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework_jwt.settings import api_settings
 
-from api.models import AuthUser, AuthUserRegistrationType
+from api.last_login import flush_last_logins
+from api.management.commands.import_users import \
+    Command as ImportUsersCommand
+from api.models import AuthUser, AuthUserRegistrationType, TaskOutbox
+from api.v1.auth.views import create_token, VERIFICATION_TOKEN
+from api.v1.authentication import CachedJSONWebTokenAuthentication
+from api.v1.throttling import TAKE_TOKENS_SCRIPT, take_tokens
+from planekstest.tasks import send_verification_email, \
+    send_verification_emails
 
 __all__ = (
     'AuthTestCase',
+    'CachedAuthenticationTestCase',
+    'LastLoginBufferTestCase',
+    'ImportUsersTestCase',
+    'ThrottleTestCase',
+    'TakeTokensScriptTestCase',
 )
 
 
@@ -59,6 +85,36 @@ class AuthTestCase(TestCase):
             __docs__save__name='ok')
         self.assertEquals(response.status_code, 200, 'Can not get access by token')
 
+    def test_password_is_checked_once(self):
+        with mock.patch.object(
+                AuthUser, 'check_password', autospec=True,
+                side_effect=AuthUser.check_password,
+        ) as check_password:
+            response = self.client.post(reverse('api_v1:login'), data={
+                'email': 'email@test.com',
+                'password': 'my_password',
+            })
+        self.assertEquals(response.status_code, 200, 'Can not login')
+        self.assertEquals(check_password.call_count, 1, 'checked twice')
+        self.assertIsNotNone(
+            AuthUser.objects.get(email='email@test.com').last_login,
+            'last_login is not updated',
+        )
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_benchmark_login(self):
+        out = io.StringIO()
+        # more logins than the login_account bucket holds
+        count = settings.THROTTLE_BUCKETS['login_account'][0] + 5
+        call_command('benchmark_login', count=count, stdout=out)
+        self.assertIn('single-pass', out.getvalue(), 'bad report')
+        self.assertFalse(
+            AuthUser.objects.filter(email__startswith='benchmark').exists(),
+            'benchmark user is not rolled back',
+        )
+
     def test_valid_login_with_uppercase_email(self):
         response = self.client.post(
             reverse('api_v1:login'), data={
@@ -190,7 +246,14 @@ class SignUpCase(BaseSignUpTestCase):
         )
         self.assertEquals(response.status_code, 200, 'Can not register')
         self.assertIsNotNone(response.data['token'], 'No token in response')
-        # self.assertEqual(len(mail.outbox), 1, 'No email in inbox')
+        self.assertEqual(len(mail.outbox), 0, 'email is sent in request')
+        user = AuthUser.objects.get(email='email@go.com')
+        task = TaskOutbox.objects.get()
+        self.assertEquals(
+            (task.task_name, json.loads(task.args)),
+            (send_verification_email.name, [user.id, VERIFICATION_TOKEN]),
+            'verification email is not enqueued',
+        )
 
     def test_invalid_register_with_empty_data(self):
         response = self.get_register_response(
@@ -213,3 +276,317 @@ class SignUpCase(BaseSignUpTestCase):
             response.status_code, 400, 'Registered user with duplicated data',
         )
 
+    def test_email_is_normalized(self):
+        response = self.get_register_response(user_email=' Email@Go.com')
+        self.assertEquals(response.status_code, 200, 'Can not register')
+        self.assertTrue(
+            AuthUser.objects.filter(email='email@go.com').exists(),
+            'email is not normalized',
+        )
+        response = self.get_register_response(user_email='EMAIL@GO.COM')
+        self.assertEquals(
+            response.status_code, 400, 'Registered email of other case',
+        )
+        self.assertEquals(
+            AuthUser.objects.get_by_natural_key('EMAIL@go.com').email,
+            'email@go.com', 'user is not found by other case',
+        )
+
+
+class CachedAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+        self.request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION='JWT ' + create_token(self.user),
+        )
+        self.authentication = CachedJSONWebTokenAuthentication()
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            user, _ = self.authentication.authenticate(self.request)
+        with self.assertNumQueries(0):
+            user, _ = self.authentication.authenticate(self.request)
+            self.assertTrue(user.is_redactor, 'bad cached user')
+        self.assertEquals(user, self.user, 'bad cached user')
+
+        self.user.reg_type = AuthUserRegistrationType.default
+        self.user.save()
+        with self.assertNumQueries(1):
+            user, _ = self.authentication.authenticate(self.request)
+        self.assertFalse(user.is_redactor, 'cached user is not invalidated')
+
+    def test_changed_email(self):
+        self.authentication.authenticate(self.request)
+        self.user.email = 'new@test.com'
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate(self.request)
+
+    def test_mixed_case_email_token(self):
+        # issued before the stored emails were lowercased
+        self.user.email = 'Email@Test.com'
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION='JWT ' + create_token(self.user),
+        )
+        user, _ = self.authentication.authenticate(request)
+        self.assertEquals(user.id, self.user.id, 'token is rejected')
+
+
+@override_settings(LAST_LOGIN_BUFFERED=True)
+class LastLoginBufferTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+
+    def login(self):
+        response = self.client.post(reverse('api_v1:login'), data={
+            'email': 'email@test.com',
+            'password': 'my_password',
+        })
+        self.assertEquals(response.status_code, 200, 'Can not login')
+
+    def test_flush(self):
+        with freeze_time('2020-01-01 12:00:00'):
+            self.login()
+        with freeze_time('2020-01-01 12:05:00'):
+            self.login()
+            self.user.refresh_from_db()
+            self.assertIsNone(self.user.last_login, 'last_login is written')
+
+            with self.assertNumQueries(1):
+                self.assertEquals(flush_last_logins(), 1, 'bad users count')
+            self.user.refresh_from_db()
+            self.assertEquals(
+                self.user.last_login, datetime(2020, 1, 1, 12, 5, tzinfo=utc),
+                'last login is not flushed',
+            )
+            self.assertEquals(flush_last_logins(), 0, 'flushed twice')
+
+    def test_late_flush_keeps_newer_login(self):
+        newer = datetime(2020, 1, 1, 12, 5, tzinfo=utc)
+        AuthUser.objects.filter(id=self.user.id).update(last_login=newer)
+        with freeze_time('2020-01-01 12:00:00'):
+            self.login()
+            flush_last_logins()
+        self.user.refresh_from_db()
+        self.assertEquals(self.user.last_login, newer, 'last_login moved back')
+
+
+class ImportUsersTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        AuthUser.objects.create_user('existing@test.com', 'my_password')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_csv(self):
+        path = self.write('users.csv', (
+            'email,password,first_name,last_name,reg_type\n'
+            'First@Test.com,first_password,First,User,redactor\n'
+            'EXISTING@test.com,other_password,,,\n'
+            'second@test.com,second_password,Second,User,\n'
+            'first@test.com,duplicate,,,\n'
+        ))
+        out = io.StringIO()
+        call_command(
+            'import_users', path, batch_size=2, workers=2,
+            send_verification=True, stdout=out,
+        )
+        self.assertIn(
+            '4 read, 2 created, 2 skipped', out.getvalue(), 'bad report',
+        )
+        first = AuthUser.objects.get(email='first@test.com')
+        self.assertTrue(first.check_password('first_password'), 'bad hash')
+        self.assertTrue(first.is_redactor, 'bad reg_type')
+        self.assertTrue(
+            AuthUser.objects.get(email='existing@test.com').check_password(
+                'my_password',
+            ), 'existing user is changed',
+        )
+        second = AuthUser.objects.get(email='second@test.com')
+        tasks = [
+            (task.task_name, json.loads(task.args))
+            for task in TaskOutbox.objects.order_by('id')
+        ]
+        self.assertEquals(tasks, [
+            (send_verification_emails.name, [[first.id], VERIFICATION_TOKEN]),
+            (send_verification_emails.name, [[second.id], VERIFICATION_TOKEN]),
+        ], 'verification is not enqueued per batch')
+        send_verification_emails([first.id, second.id], VERIFICATION_TOKEN)
+        self.assertEquals(
+            [msg.to[0] for msg in mail.outbox],
+            ['first@test.com', 'second@test.com'], 'emails are not sent',
+        )
+        self.assertFalse(
+            os.path.exists(path + '.checkpoint'), 'checkpoint is left',
+        )
+
+    def test_email_taken_meanwhile(self):
+        class RegisteringExecutor:
+            # a user registers while the passwords are hashed
+            def map(self, func, iterable, chunksize=1):
+                AuthUser.objects.create_user('taken@test.com', 'my_password')
+                return map(func, iterable)
+
+        command = ImportUsersCommand()
+        command.workers = 1
+        user_ids = command.create_users([
+            {'email': 'taken@test.com', 'password': 'password'},
+            {'email': 'new@test.com', 'password': 'password'},
+        ], RegisteringExecutor(), {'send_verification': False})
+        self.assertEquals(
+            user_ids, [AuthUser.objects.get(email='new@test.com').id],
+            'bad created users',
+        )
+        self.assertTrue(
+            AuthUser.objects.get(email='taken@test.com').check_password(
+                'my_password',
+            ), 'registered user is changed',
+        )
+
+    def test_resume_ndjson(self):
+        path = self.write('users.ndjson', '\n'.join(
+            json.dumps({'email': 'user%s@test.com' % i, 'password': 'pass'})
+            for i in range(3)
+        ))
+        self.write('users.ndjson.checkpoint', json.dumps({'records': 2}))
+        call_command('import_users', path, workers=1, stdout=io.StringIO())
+        self.assertEquals(
+            list(AuthUser.objects.filter(
+                email__startswith='user',
+            ).values_list('email', flat=True)),
+            ['user2@test.com'], 'import is not resumed from checkpoint',
+        )
+
+
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        AuthUser.objects.create_user('email@test.com', 'my_password')
+
+    def login(self, email):
+        return self.client.post(reverse('api_v1:login'), data={
+            'email': email,
+            'password': 'my_password',
+        })
+
+    @override_settings(THROTTLE_BUCKETS=dict(
+        settings.THROTTLE_BUCKETS, login_account=(2, 0.001),
+    ))
+    def test_login_account(self):
+        for email in ('email@test.com', 'EMAIL@test.com'):
+            self.assertEquals(self.login(email).status_code, 200, 'throttled')
+        with self.assertNumQueries(0):
+            response = self.login('email@test.com')
+        self.assertEquals(response.status_code, 429, 'not throttled')
+        self.assertIn('Retry-After', response, 'no Retry-After')
+        self.assertEquals(
+            self.login('other@test.com').status_code, 400,
+            'other account is throttled',
+        )
+
+    @override_settings(THROTTLE_BUCKETS=dict(
+        settings.THROTTLE_BUCKETS, login_ip=(1, 0.001),
+    ))
+    def test_login_ip(self):
+        self.assertEquals(self.login('other@test.com').status_code, 400)
+        self.assertEquals(
+            self.login('email@test.com').status_code, 429, 'not throttled',
+        )
+
+    @override_settings(THROTTLE_BUCKETS=dict(
+        settings.THROTTLE_BUCKETS, login_ip=(1, 0.001),
+    ))
+    def test_login_ip_spoofed(self):
+        for address in ('10.0.0.1', '10.0.0.2'):
+            response = self.client.post(reverse('api_v1:login'), data={
+                'email': 'other@test.com',
+                'password': 'my_password',
+            }, HTTP_X_FORWARDED_FOR=address)
+        self.assertEquals(
+            response.status_code, 429, 'X-Forwarded-For skips throttling',
+        )
+
+
+def get_lua_redis():
+    """
+    Redis of THROTTLE_REDIS_URL or fakeredis, None if it runs no Lua
+    """
+    if settings.THROTTLE_REDIS_URL:
+        client = redis.StrictRedis.from_url(settings.THROTTLE_REDIS_URL)
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            return None
+        client = fakeredis.FakeStrictRedis()
+    try:
+        client.eval('return 1', 0)
+    except redis.RedisError:
+        return None
+    return client
+
+
+class TakeTokensScriptTestCase(TestCase):
+    def setUp(self):
+        client = get_lua_redis()
+        if client is None:
+            self.skipTest('no Redis running Lua scripts')
+        overridden = override_settings(
+            THROTTLE_REDIS_URL='redis://', THROTTLE_BUCKETS={
+                'small': (2, 0.001),
+                'large': (5, 0.001),
+            },
+        )
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        for target, value in (
+                ('api.v1.throttling._script',
+                 client.register_script(TAKE_TOKENS_SCRIPT)),
+                # failures of the script must not pass as allowed
+                ('api.v1.throttling.logging', mock.MagicMock()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # keys of other runs on a real Redis are not shared
+        self.ident = uuid.uuid4().hex
+
+    def test_bucket(self):
+        for i in range(2):
+            self.assertEquals(
+                take_tokens([('small', self.ident)]), (True, 0), 'throttled',
+            )
+        allowed, wait = take_tokens([('small', self.ident)])
+        self.assertFalse(allowed, 'not throttled')
+        self.assertGreater(wait, 0, 'no wait')
+        self.assertEquals(
+            take_tokens([('small', self.ident + 'other')]), (True, 0),
+            'other identity is throttled',
+        )
+
+    def test_all_or_nothing(self):
+        buckets = [('small', self.ident), ('large', self.ident)]
+        for i in range(2):
+            self.assertTrue(take_tokens(buckets)[0], 'throttled')
+        self.assertFalse(take_tokens(buckets)[0], 'not throttled')
+        # the empty bucket kept the token of the other one
+        for i in range(3):
+            self.assertTrue(
+                take_tokens([('large', self.ident)])[0], 'token is lost',
+            )
+        self.assertFalse(
+            take_tokens([('large', self.ident)])[0], 'token is not taken',
+        )
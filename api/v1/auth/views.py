@@ -1,11 +1,14 @@
 from copy import deepcopy
+from datetime import datetime
 
 from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
 from rest_framework import status
 from rest_framework.generics import (
     GenericAPIView)
 from rest_framework.response import Response
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings
 from rest_framework_jwt.serializers import JSONWebTokenSerializer, \
     jwt_payload_handler, jwt_encode_handler
 from rest_framework_jwt.views import RefreshJSONWebToken, \
@@ -15,6 +18,8 @@ from rest_framework_jwt.views import jwt_response_payload_handler
 from api.mailing import send_register_email
 from api.v1.auth.serializers import RegistrationSerializer
 from api.models import AuthUserRegistrationType, AuthUser
+from api.outbox import enqueue_task
+from api.v1.throttling import LoginThrottle, RegistrationThrottle
 from planekstest.tasks import send_verification_email
 
 
@@ -44,20 +49,30 @@ class LoginView(JSONWebTokenAPIView):
 
     """
     serializer_class = JSONWebTokenSerializer
+    throttle_classes = (LoginThrottle,)
 
     def post(self, request, *args, **kwargs):
-        if request.data.get('email'):
-            request_mutability = request.POST._mutable
-            request.POST._mutable = True
-            request.data['email'] = request.data['email'].lower()
-            request.POST._mutable = request_mutability
-            # Updating last_login date
-            serializer = self.serializer_class(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            user = serializer.validated_data['user']
-            user_logged_in.send(sender=user.__class__, request=request,
-                                user=user)
-        return super(LoginView, self).post(request, *args, **kwargs)
+        # the email is normalized by AuthUserManager.get_by_natural_key,
+        # credentials are checked once, password hashing is the most of login
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST,
+            )
+        user = serializer.object['user']
+        token = serializer.object['token']
+        # Updating last_login date
+        user_logged_in.send(sender=user.__class__, request=request, user=user)
+        response = Response(
+            jwt_response_payload_handler(token, user, request),
+        )
+        if api_settings.JWT_AUTH_COOKIE:
+            response.set_cookie(
+                api_settings.JWT_AUTH_COOKIE, token,
+                expires=datetime.utcnow() + api_settings.JWT_EXPIRATION_DELTA,
+                httponly=True,
+            )
+        return response
 
 
 class RefreshTokenView(TokenFromHeaderMixin, RefreshJSONWebToken):
@@ -82,6 +97,10 @@ class VerifyTokenView(TokenFromHeaderMixin, VerifyJSONWebToken):
     pass
 
 
+# not implemented: ConfirmationLink token, see below
+VERIFICATION_TOKEN = 'asdasdasdcalsdlasldalsdalsdl'
+
+
 def create_token(user):
     payload = jwt_payload_handler(user)
     token = jwt_encode_handler(payload)
@@ -90,6 +109,7 @@ def create_token(user):
 
 class RegistrationView(GenericAPIView):
     serializer_class = RegistrationSerializer
+    throttle_classes = (RegistrationThrottle,)
 
     def post(self, request, *args, **kwargs):
         """
@@ -111,22 +131,20 @@ class RegistrationView(GenericAPIView):
                 extra_fields.pop(extra_field)
 
         if reg_type == AuthUserRegistrationType.default:
-            user = AuthUser.objects.create_user(
-                vd['email'], vd['password'], **extra_fields
-            )
+            create_user = AuthUser.objects.create_user
         elif reg_type == AuthUserRegistrationType.redactor:
-            user = AuthUser.objects.create_redactor(
-                vd['email'], vd['password'], **extra_fields
-            )
+            create_user = AuthUser.objects.create_redactor
         else:
             return Response(dict(), status=status.HTTP_400_BAD_REQUEST)
-        if not user.is_email_confirmed:
-            #
-            #token = ConfirmationLink(user=user, type=ConfirmationLinkType.confirm_email)
-            #token.save()
-            user_id = user.id
-            token = 'asdasdasdcalsdlasldalsdalsdl'
-            send_verification_email.delay(user_id, token)
+        with transaction.atomic():
+            user = create_user(vd['email'], vd['password'], **extra_fields)
+            if not user.is_email_confirmed:
+                #
+                #token = ConfirmationLink(user=user, type=ConfirmationLinkType.confirm_email)
+                #token.save()
+                enqueue_task(
+                    send_verification_email, (user.id, VERIFICATION_TOKEN),
+                )
         return Response(
             jwt_response_payload_handler(
                 token=create_token(user), user=user, request=request
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, \
+    jwt_get_username_from_payload
+
+from api.cache import get_user_cache_key
+from api.models import AuthUser
+
+__all__ = (
+    'CachedJSONWebTokenAuthentication',
+)
+
+# fields used by permissions and views, others are loaded on access
+USER_CACHE_FIELDS = (
+    'id',
+    'email',
+    'first_name',
+    'last_name',
+    'user_type',
+    'reg_type',
+    'is_superuser',
+    'is_email_confirmed',
+)
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication which takes the user from the cache,
+    the cached user is invalidated by `AuthUser.save`
+    """
+
+    def authenticate_credentials(self, payload):
+        user_id = payload.get('user_id')
+        username = jwt_get_username_from_payload(payload)
+        if user_id is None or not username:
+            return super().authenticate_credentials(payload)
+
+        key = get_user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            values = AuthUser.objects.filter(id=user_id).values(
+                *USER_CACHE_FIELDS
+            ).first()
+            if values is None:
+                raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+            cache.set(key, values, settings.AUTH_USER_CACHE_TIMEOUT)
+        # from_db takes values in the order of model fields
+        field_names = [
+            field.attname for field in AuthUser._meta.concrete_fields
+            if field.attname in values
+        ]
+        user = AuthUser.from_db(
+            AuthUser.objects.db, field_names,
+            [values[name] for name in field_names],
+        )
+
+        # the token of a user whose email changed is not valid anymore;
+        # tokens issued before emails were normalized keep the case
+        if user.email != AuthUser.objects.normalize_email(username):
+            raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User account is disabled.'),
+            )
+        return user
@@ -1,9 +1,10 @@
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 # ById serializers are used to get instance by id
 from api.models import UploadedImage
-from . import model_serializers
 
 
 class ImageByIdSerializer(serializers.UUIDField):
@@ -16,9 +17,45 @@ class ImageByIdSerializer(serializers.UUIDField):
             raise ValidationError('No image with this id')
 
     def to_representation(self, instance):
-        return model_serializers.UploadedImageSerializer(
-            instance=instance, context=self.context
-        ).data
+        return self.image_serializer.to_representation(instance)
+
+    @cached_property
+    def image_serializer(self):
+        # one serializer per field, not one per rendered post
+        return model_serializers.UploadedImageSerializer(context=self.context)
+
+
+class ImageIdOnlyListSerializer(serializers.ListSerializer):
+    """
+    Validates ids of all items, then resolves images with one query;
+    only images of the context user not attached to a post are accepted
+    """
+
+    def get_image_error(self, image):
+        if image is None:
+            return 'No image with this id'
+        if image.post_id is not None:
+            return 'Image is attached to a post'
+        if image.uploaded_by_id != self.context['user'].id:
+            return 'Image is uploaded by another user'
+        return None
+
+    def to_internal_value(self, data):
+        image_ids = super(ImageIdOnlyListSerializer, self).to_internal_value(
+            data,
+        )
+        images = UploadedImage.objects.in_bulk(image_ids)
+        errors = []
+        for image_id in image_ids:
+            error = self.get_image_error(images.get(image_id))
+            errors.append(
+                {} if error is None else {
+                    api_settings.NON_FIELD_ERRORS_KEY: [error],
+                }
+            )
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [images[image_id] for image_id in image_ids]
 
 
 # IdOnly serializers are used to keep same structure in update/create queries,
@@ -26,7 +63,18 @@ class ImageByIdSerializer(serializers.UUIDField):
 class ImageIdOnlySerializer(serializers.Serializer):
     id = serializers.UUIDField()  # omit default validation
 
+    class Meta:
+        list_serializer_class = ImageIdOnlyListSerializer
+
+    def __init__(self, *args, **kwargs):
+        # resolve=False validates only the id, e.g. to find image in a list
+        self.resolve = kwargs.pop('resolve', True)
+        super(ImageIdOnlySerializer, self).__init__(*args, **kwargs)
+
     def validate(self, data):
+        if not self.resolve or \
+                isinstance(self.parent, ImageIdOnlyListSerializer):
+            return data['id']
         try:
             return UploadedImage.objects.get(id=data['id'])
         except ObjectDoesNotExist:
@@ -35,3 +83,7 @@ class ImageIdOnlySerializer(serializers.Serializer):
     def to_representation(self, instance):
         return model_serializers.UploadedImageSerializer(instance=instance,
                                                          context=self.context).data
+
+
+# model_serializers imports this module, import it last to break the cycle
+from . import model_serializers  # noqa: E402
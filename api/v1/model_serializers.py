@@ -1,14 +1,62 @@
+from collections import OrderedDict
+
+from django.conf import settings
 from django.core.validators import MaxLengthValidator
 from django.db import transaction
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
 from rest_framework import serializers
 
 
-from api.models import Post, Comment, AuthUser, UploadedImage
+from api.images import create_uploaded_image
+from api.models import Post, Comment, AuthUser, UploadedImage, Tag
 from api.v1.fields_serializers import ImageByIdSerializer
 
 
+class EagerLoadingListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        if isinstance(data, QuerySet):
+            data = self.child.setup_eager_loading(data)
+        else:
+            data = list(data)
+            self.child.prefetch_instances(data)
+        return super(EagerLoadingListSerializer, self).to_representation(data)
+
+
+class EagerLoadingMixin:
+    """
+    Applies the prefetch plan declared in `Meta.select_related` and
+    `Meta.prefetch_related` before rendering, so nested data costs a fixed
+    number of queries per response instead of per instance.
+    Use `EagerLoadingListSerializer` as `Meta.list_serializer_class`.
+    """
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        select_related = getattr(cls.Meta, 'select_related', ())
+        prefetch_related = getattr(cls.Meta, 'prefetch_related', ())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    @classmethod
+    def prefetch_instances(cls, instances):
+        # select_related can't be applied to loaded rows, prefetch instead
+        lookups = tuple(getattr(cls.Meta, 'select_related', ())) + \
+            tuple(getattr(cls.Meta, 'prefetch_related', ()))
+        if instances and lookups:
+            prefetch_related_objects(instances, *lookups)
+
+    def to_representation(self, instance):
+        if not isinstance(self.parent, serializers.ListSerializer):
+            self.prefetch_instances([instance])
+        return super(EagerLoadingMixin, self).to_representation(instance)
+
+
 class UploadedImageSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
+    srcset = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = UploadedImage
@@ -16,17 +64,45 @@ class UploadedImageSerializer(serializers.ModelSerializer):
             'id',
             'img',
             'url',
+            'srcset',
+            'width',
+            'height',
+            'format',
+            'byte_size',
         )
 
         extra_kwargs = {
             'id': {'read_only': True},
             'img': {'write_only': True},
+            'width': {'read_only': True},
+            'height': {'read_only': True},
+            'format': {'read_only': True},
+            'byte_size': {'read_only': True},
         }
 
+    def create(self, validated_data):
+        return create_uploaded_image(validated_data.pop('img'), **validated_data)
+
     def get_url(self, instance):
         if instance is not None:
             return self.context['request'].build_absolute_uri(instance.img.url)
 
+    def get_srcset(self, instance):
+        """
+        Urls by width, `original` is there while derivatives are not ready
+        """
+        if instance is None:
+            return None
+        build_absolute_uri = self.context['request'].build_absolute_uri
+        # derivatives are made per blob, shared by images of the content
+        owner = instance.blob if instance.blob_id is not None else instance
+        srcset = OrderedDict(
+            ('%sw' % derivative.width, build_absolute_uri(derivative.img.url))
+            for derivative in owner.derivatives.all()
+        )
+        srcset['original'] = build_absolute_uri(instance.img.url)
+        return srcset
+
 
 class AuthUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -61,7 +137,7 @@ class CommentSerializer(serializers.ModelSerializer):
         )
 
 
-class FullPostSerializer(serializers.ModelSerializer):
+class FullPostSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     tags = serializers.ListSerializer(
         child=serializers.CharField(max_length=20),
         allow_empty=True,
@@ -71,9 +147,7 @@ class FullPostSerializer(serializers.ModelSerializer):
     images = serializers.ListSerializer(child=UploadedImageSerializer(),
                                         validators=[MaxLengthValidator(10)],
                                         allow_empty=False)
-    comments = serializers.ListSerializer(child=CommentSerializer(),
-                                          validators=[MaxLengthValidator(10)],
-                                          allow_empty=False)
+    comments = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
@@ -93,15 +167,40 @@ class FullPostSerializer(serializers.ModelSerializer):
             'date_published',
             'date_modified',
             'comments',
+            'comment_count',
+            'image_count',
+        )
+        list_serializer_class = EagerLoadingListSerializer
+        select_related = ('default_image__blob',)
+        prefetch_related = (
+            Prefetch('tags', queryset=Tag.objects.all()),
+            'default_image__derivatives',
+            'default_image__blob__derivatives',
+            Prefetch(
+                'images',
+                queryset=UploadedImage.objects.select_related('blob'),
+            ),
+            'images__derivatives',
+            'images__blob__derivatives',
         )
 
+    def get_comments(self, instance):
+        """
+        Latest comments, the rest are paged by `posts/<id>/comments`.
+        Posts are rendered one by one, so it is an indexed query per post.
+        """
+        comments = instance.comments.order_by(
+            '-date_created', '-id',
+        )[:settings.POST_DETAIL_COMMENTS]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
     def to_representation(self, instance):
         data = super(FullPostSerializer, self).to_representation(instance)
         data['tags'] = list(map(lambda x: x.name, instance.tags.all()))
         return data
 
 
-class ShortPostSerializer(serializers.ModelSerializer):
+class ShortPostSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     default_image = ImageByIdSerializer()
 
     tags = serializers.ListSerializer(
@@ -118,6 +217,15 @@ class ShortPostSerializer(serializers.ModelSerializer):
             'default_image',
             'tags',
             'is_archived',
+            'comment_count',
+            'image_count',
+        )
+        list_serializer_class = EagerLoadingListSerializer
+        select_related = ('default_image__blob',)
+        prefetch_related = (
+            Prefetch('tags', queryset=Tag.objects.all()),
+            'default_image__derivatives',
+            'default_image__blob__derivatives',
         )
 
     def to_representation(self, instance):
@@ -0,0 +1,174 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from urllib import parse
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, \
+    replace_query_param
+
+__all__ = (
+    'MyLimitOffsetPagination',
+    'KeysetPagination',
+    'KeysetCursorPagination',
+)
+
+
+class MyLimitOffsetPagination(LimitOffsetPagination):
+    max_limit = 100
+    default_limit = 12
+
+
+class KeysetPagination(MyLimitOffsetPagination):
+    """
+    Limit/offset pagination with an opaque cursor mode
+
+    When `cursor` is present in the query (empty for the first page) the
+    queryset is paged by its `order_by` fields with a `WHERE (a, b) < (x, y)`
+    style filter instead of `OFFSET`, so every page costs the same.
+    The ordering must end with a unique field (e.g. `id`) and its fields
+    must not be null. Without `cursor` it is plain limit/offset, unless
+    `cursor_only` is set.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+    cursor_only = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        if self.cursor_query_param not in request.query_params and \
+                not self.cursor_only:
+            return super(KeysetPagination, self).paginate_queryset(
+                queryset, request, view,
+            )
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.ordering = queryset.query.order_by
+        if not self.ordering:
+            raise ValueError('Keyset pagination needs an ordered queryset')
+        self.cursor = reverse, position = self.decode_cursor(
+            request, queryset.model,
+        )
+
+        if position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(position))
+        if reverse:
+            queryset = queryset.order_by(
+                *(self._flip(field) for field in self.ordering)
+            )
+
+        rows = list(queryset[:self.limit + 1])
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if reverse:
+            rows.reverse()
+
+        # going backwards there is always a page after this one
+        has_next = reverse or has_more
+        has_previous = has_more if reverse else position is not None
+        self.next_position = self.previous_position = None
+        if rows and has_next:
+            self.next_position = self._get_position(rows[-1])
+        if rows and has_previous:
+            self.previous_position = self._get_position(rows[0])
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.cursor is None:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if self.cursor is None:
+            return super(KeysetPagination, self).get_next_link()
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if self.cursor is None:
+            return super(KeysetPagination, self).get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(True, self.previous_position)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+
+        try:
+            querystring = urlsafe_b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            values = tokens['p']
+            if len(values) != len(self.ordering):
+                raise ValueError('Cursor does not match ordering')
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (
+                TypeError, ValueError, KeyError, UnicodeError,
+                DjangoValidationError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        return reverse, position
+
+    def encode_cursor(self, reverse, position):
+        tokens = {'p': [self._to_token(value) for value in position]}
+        if reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = urlsafe_b64encode(querystring.encode('ascii'))
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(
+            url, self.cursor_query_param, encoded.decode('ascii'),
+        )
+
+    def _get_keyset_filter(self, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        reverse = self.cursor[0]
+        keyset_filter = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            keyset_filter |= Q(**equal) & Q(**{lookup: value})
+            equal[name] = value
+        return keyset_filter
+
+    def _get_position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _to_token(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+
+class KeysetCursorPagination(KeysetPagination):
+    """
+    Keyset pagination without offsets, for lists too long to count
+    """
+    cursor_only = True
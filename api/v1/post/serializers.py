@@ -2,14 +2,14 @@ from datetime import datetime
 
 from django.core.validators import MaxLengthValidator
 from django.db import transaction
-from django.db.models import Q
 from pytz import utc
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from api.models import Post, Tag, \
-    PostReviewStatus
-from api.v1.fields_serializers import ImageIdOnlySerializer
+    PostReviewStatus, UploadedImage
+from api.v1.fields_serializers import ImageIdOnlySerializer, \
+    ImageIdOnlyListSerializer
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -20,13 +20,16 @@ class PostCreateSerializer(serializers.ModelSerializer):
         validators=[MaxLengthValidator(10)],
         write_only=True,
         required=False, )
-    default_image = ImageIdOnlySerializer(required=False, allow_null=True, )
-    images = serializers.ListSerializer(child=ImageIdOnlySerializer(),
-                                        validators=[MaxLengthValidator(10)],
-                                        allow_empty=True,
-                                        write_only=True,
-                                        required=False,
-                                        allow_null=True, )
+    # resolved from images in validate, no separate query
+    default_image = ImageIdOnlySerializer(
+        required=False, allow_null=True, resolve=False,
+    )
+    images = ImageIdOnlyListSerializer(child=ImageIdOnlySerializer(),
+                                       validators=[MaxLengthValidator(10)],
+                                       allow_empty=True,
+                                       write_only=True,
+                                       required=False,
+                                       allow_null=True, )
 
     class Meta:
         model = Post
@@ -48,27 +51,23 @@ class PostCreateSerializer(serializers.ModelSerializer):
         if images is None:
             images = []
 
-        default_image = vd.get('default_image', None)
-        if default_image is not None and default_image not in images:
-            raise ValidationError('This image must be in images too.')
+        default_image_id = vd.get('default_image', None)
+        default_image = None
+        if default_image_id is not None:
+            default_image = next(
+                (image for image in images if image.id == default_image_id),
+                None,
+            )
+            if default_image is None:
+                raise ValidationError('This image must be in images too.')
         vd['default_image'] = default_image
         vd['images'] = images
         return vd
 
     def make_instances(self, validated_data):
         user = self.context['user']
-        dirty_tags_vd = validated_data.pop('tags', [])
-        # use only tags which are unique
-        tags = []
-        for tag_name in dirty_tags_vd:
-            tag = Tag.objects.filter(
-                Q(name=tag_name.upper()) or
-                Q(name=tag_name.lower()) or
-                Q(name=tag_name)
-            ).first()
-            if tag is None:
-                tag = Tag(name=tag_name)
-            tags.append(tag)
+        # existing tags are matched case-insensitively, missing are created
+        tags = Tag.objects.resolve(validated_data.pop('tags', []))
 
         default_image = validated_data.pop('default_image', None)
         images = validated_data.pop('images', None)
@@ -90,18 +89,24 @@ class PostCreateSerializer(serializers.ModelSerializer):
         elif user.is_default:
             post.review_status = PostReviewStatus.pending
 
-        for image in images:
-            if image.pk is None:
-                image.save()
-
-        for tag in tags:
-            if tag.id is None:
-                tag.save()
         post.save()
         post.tags.add(*tags)
         post.save()
+        # update() skips signals, caches of the post and feed are
+        # invalidated by post.save above, once more on commit
+        if images:
+            # an image attached by a concurrent request is not taken over
+            attached = UploadedImage.objects.filter(
+                id__in=[image.id for image in images],
+                post__isnull=True, uploaded_by=user,
+            ).update(post=post)
+            if attached != len({image.id for image in images}):
+                raise ValidationError({
+                    'images': ['Images are attached to another post'],
+                })
+            Post.objects.add_counts(post.id, images=attached)
+            post.image_count += attached
         for image in images:
             image.post_id = post.id
-            image.save()
 
         return post
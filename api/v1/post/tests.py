@@ -1,10 +1,42 @@
+import io
+import os
+import queue
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
+
+from celery.canvas import Signature
+from django.conf import settings
 from django.core import mail
-from django.test import TestCase
+from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, \
+    override_settings
 from django.urls import reverse
+from django.utils import timezone
+from freezegun import freeze_time
+from kombu.exceptions import OperationalError
+from pytz import utc
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 
-from api.models import AuthUser, Post
+from api.cache import get_cache_stats, get_feed_generation, \
+    get_post_version
+from api.dispatch import TaskDispatcher, dispatcher as outbox_dispatcher
+from api.mailing import send_emails
+from api.outbox import relay_outbox
+from api.models import AuthUser, Post, PostReviewStatus, Tag, Comment, \
+    UploadedImage, PendingCommentNotification, TaskOutbox
 from api.utils import test_file
+from api.v1.post.serializers import PostCreateSerializer
+from planekstest.celery import app
+from planekstest.tasks import send_new_comment_email, \
+    send_new_comment_digest, send_new_comment_digests, notify_new_comment, \
+    sweep_new_comment_digests
 
 
 class PostTestCase(TestCase):
@@ -29,6 +61,16 @@ class PostTestCase(TestCase):
         return response.data['token']
 
     def setUp(self):
+        cache.clear()
+        # uploads of the tests are not left in the project
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_UPLOAD_SESSIONS_DIR=os.path.join(self.media_root, 'sessions'),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
         self.client = APIClient()
         self.__create_test_user()
         self.token = self.__get_test_user_token()
@@ -103,3 +145,754 @@ class PostTestCase(TestCase):
             response.status_code, 200, 'Cant get post detail'
         )
 
+
+class PostFeedPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        # pairs of posts share date_published to check the id tie-breaker
+        for i in range(7):
+            Post.objects.create(
+                title='post %s' % i,
+                review_status=PostReviewStatus.approved,
+                date_published=datetime(2019, 11, 1 + i // 2, tzinfo=utc),
+            )
+        Post.objects.create(title='pending', review_status=PostReviewStatus.pending)
+
+    def test_cursor_pages(self):
+        expected = list(
+            Post.objects.filter(
+                review_status=PostReviewStatus.approved,
+            ).order_by('-date_published', '-id').values_list('id', flat=True)
+        )
+        response = self.client.get(
+            reverse('api_v1:posts-lc'), data={'limit': 3, 'cursor': ''},
+        )
+        self.assertEquals(response.status_code, 200, 'Cant get posts')
+        self.assertNotIn('count', response.data, 'cursor page has count')
+        self.assertIsNone(response.data['previous'], 'first page has previous')
+
+        pages = [response.data]
+        while pages[-1]['next'] is not None:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        ids = [post['id'] for page in pages for post in page['results']]
+        self.assertEquals(ids, expected, 'cursor pages skip or repeat posts')
+
+        previous = self.client.get(pages[-1]['previous']).data
+        self.assertEquals(
+            [post['id'] for post in previous['results']],
+            [post['id'] for post in pages[-2]['results']],
+            'previous link returns wrong page',
+        )
+
+        response = self.client.get(
+            reverse('api_v1:posts-lc'), data={'limit': 3, 'offset': 3},
+        )
+        self.assertEquals(response.data['count'], 7, 'bad count')
+        self.assertEquals(
+            [post['id'] for post in response.data['results']], expected[3:6],
+            'limit/offset page differs from cursor order',
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse('api_v1:posts-lc'), data={'cursor': 'not a cursor'},
+        )
+        self.assertEquals(response.status_code, 404, 'Bad cursor accepted')
+
+
+class PostQueryCountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.tags = [Tag.objects.create(name='tag_%s' % i) for i in range(3)]
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                title='post %s' % i, review_status=PostReviewStatus.approved,
+            )
+            image = UploadedImage.objects.create(img='img.png', post=post)
+            post.default_image = image
+            post.save()
+            post.tags.add(*self.tags)
+            Comment.objects.create(
+                name='name', email='email@test.com', text='text', post=post,
+            )
+
+    def test_feed_query_count_is_fixed(self):
+        self.create_posts(1)
+        # count, page with default images, tags, derivatives of images
+        with self.assertNumQueries(4):
+            self.client.get(reverse('api_v1:posts-lc'))
+        self.create_posts(20)
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse('api_v1:posts-lc'), data={'limit': 100},
+            )
+        self.assertEquals(len(response.data['results']), 21, 'bad page')
+        # cursor pages skip the count
+        with self.assertNumQueries(3):
+            self.client.get(
+                reverse('api_v1:posts-lc'), data={'limit': 100, 'cursor': ''},
+            )
+
+    def test_feed_cache(self):
+        self.create_posts(2)
+        response = self.client.get(reverse('api_v1:posts-lc'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('api_v1:posts-lc'))
+        self.assertEquals(cached.content, response.content, 'bad cached page')
+        self.assertEquals(
+            get_cache_stats('feed'), {'hits': 1, 'misses': 1}, 'bad stats',
+        )
+
+        post = Post.objects.first()
+        post.tags.remove(self.tags[0])
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('api_v1:posts-lc'))
+        self.assertNotEquals(
+            cached.content, response.content, 'stale page after tags change',
+        )
+        post.title = 'new title'
+        post.save()
+        response = self.client.get(reverse('api_v1:posts-lc'))
+        self.assertIn(b'new title', response.content, 'stale page after save')
+
+    def test_feed_cache_comments(self):
+        self.create_posts(2)
+        pending = Post.objects.create(
+            title='pending', review_status=PostReviewStatus.pending,
+        )
+        url = reverse('api_v1:posts-lc')
+        by_comments = {'ordering': 'comments'}
+        self.client.get(url)
+        response = self.client.get(url, data=by_comments)
+        self.assertEquals(
+            response.data['results'][0]['title'], 'post 1', 'bad order',
+        )
+
+        Comment.objects.create(
+            name='name', email='email@test.com', text='text', post=pending,
+        )
+        with self.assertNumQueries(0):
+            self.client.get(url, data=by_comments)
+        post = Post.objects.get(title='post 0')
+        for i in range(2):
+            Comment.objects.create(
+                name='name', email='email@test.com', text='text', post=post,
+            )
+        Post.objects.add_counts(post.id, comments=2)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        response = self.client.get(url, data=by_comments)
+        self.assertEquals(
+            response.data['results'][0]['title'], 'post 0',
+            'stale comment order',
+        )
+
+    def test_detail_query_count_is_fixed(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        for i in range(5):
+            UploadedImage.objects.create(img='img.png', post=post)
+            Comment.objects.create(
+                name='name', email='email@test.com', text='text', post=post,
+            )
+        # post with default image, tags, images, derivatives x2,
+        # latest comments
+        with self.assertNumQueries(6):
+            response = self.client.get(
+                reverse('api_v1:post-details', kwargs={'id': post.id}),
+            )
+        self.assertEquals(len(response.data['comments']), 6, 'bad comments')
+        self.assertEquals(len(response.data['tags']), 3, 'bad tags')
+
+    @override_settings(POST_DETAIL_COMMENTS=3)
+    def test_detail_comments_are_bounded(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        for i in range(10):
+            Comment.objects.create(
+                name='name', email='email@test.com', text=str(i), post=post,
+            )
+        response = self.client.get(
+            reverse('api_v1:post-details', kwargs={'id': post.id}),
+        )
+        self.assertEquals(
+            [comment['text'] for comment in response.data['comments']],
+            ['9', '8', '7'], 'not latest comments',
+        )
+
+    def test_comments_pages(self):
+        self.create_posts(2)
+        post = Post.objects.order_by('id').first()
+        for i in range(25):
+            Comment.objects.create(
+                name='name', email='email@test.com', text=str(i), post=post,
+            )
+        url = reverse('api_v1:post-comments', kwargs={'id': post.id})
+        url += '?limit=10'
+        texts = []
+        while url:
+            # page cost doesn't depend on its depth
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEquals(response.status_code, 200, 'can not get page')
+            self.assertNotIn('count', response.data, 'comments are counted')
+            texts.extend(comment['text'] for comment in response.data['results'])
+            url = response.data['next']
+        self.assertEquals(
+            texts, [str(i) for i in reversed(range(25))] + ['text'],
+            'bad comments order',
+        )
+
+        response = self.client.get(
+            reverse('api_v1:post-comments', kwargs={'id': 100500}),
+        )
+        self.assertEquals(response.status_code, 404, 'comments of no post')
+
+    def test_detail_cache(self):
+        self.create_posts(2)
+        post, other_post = Post.objects.order_by('id')
+        url = reverse('api_v1:post-details', kwargs={'id': post.id})
+        other_url = reverse('api_v1:post-details', kwargs={'id': other_post.id})
+        self.client.get(url)
+        self.client.get(other_url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        Comment.objects.create(
+            name='name', email='email@test.com', text='new comment', post=post,
+        )
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+        response = self.client.get(url)
+        self.assertEquals(len(response.data['comments']), 2, 'stale comments')
+        self.assertEquals(
+            get_cache_stats('post'), {'hits': 2, 'misses': 3}, 'bad stats',
+        )
+
+        self.tags[0].name = 'renamed'
+        self.tags[0].save()
+        response = self.client.get(other_url)
+        self.assertIn('renamed', response.data['tags'], 'stale tags')
+
+    def test_detail_cache_missing_post(self):
+        for post_id in range(1000, 1005):
+            response = self.client.get(
+                reverse('api_v1:post-details', kwargs={'id': post_id}),
+            )
+            self.assertEquals(response.status_code, 404, 'post is found')
+            self.assertIsNone(
+                get_post_version(post_id, create=False),
+                'version of a missing post',
+            )
+
+    def test_version_expires(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        with freeze_time() as frozen:
+            version = get_post_version(post.id)
+            frozen.tick(timedelta(seconds=settings.CACHE_VERSION_TIMEOUT + 1))
+            self.assertIsNone(
+                get_post_version(post.id, create=False), 'version is kept',
+            )
+            self.assertGreater(
+                get_post_version(post.id), version, 'renewed version repeats',
+            )
+
+    def test_detail_cache_zero_padded_id(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        url = reverse('api_v1:post-details', kwargs={'id': '00%s' % post.id})
+        self.client.get(url)
+        Comment.objects.create(
+            name='name', email='email@test.com', text='new comment', post=post,
+        )
+        response = self.client.get(url)
+        self.assertEquals(len(response.data['comments']), 2, 'stale comments')
+
+    def test_conditional_get(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        self.assertIsNotNone(post.date_modified, 'date_modified not set')
+        url = reverse('api_v1:post-details', kwargs={'id': post.id})
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304, 'etag is not checked')
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEquals(response.status_code, 304, 'date is not checked')
+
+        Comment.objects.create(
+            name='name', email='email@test.com', text='text', post=post,
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200, 'stale etag matched')
+        self.assertNotEquals(response['ETag'], etag, 'etag is not changed')
+        post.refresh_from_db()
+        self.assertGreater(
+            post.date_modified, post.date_created, 'date_modified not touched',
+        )
+
+        response = self.client.get(reverse('api_v1:posts-lc'))
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('api_v1:posts-lc'), HTTP_IF_NONE_MATCH=etag,
+            )
+        self.assertEquals(response.status_code, 304, 'feed etag not checked')
+        post.save()
+        response = self.client.get(
+            reverse('api_v1:posts-lc'), HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEquals(response.status_code, 200, 'stale feed etag matched')
+
+
+class TagResolveTestCase(TestCase):
+    def test_resolve(self):
+        Tag.objects.create(name='Existing')
+        with self.assertNumQueries(3):
+            tags = Tag.objects.resolve(
+                ['existing', 'EXISTING', 'New'] +
+                ['tag_%s' % i for i in range(7)]
+            )
+        self.assertEquals(
+            [tag.name for tag in tags],
+            ['Existing', 'New'] + ['tag_%s' % i for i in range(7)],
+            'bad tags',
+        )
+        self.assertTrue(all(tag.id for tag in tags), 'tags without id')
+        self.assertEquals(Tag.objects.count(), 9, 'duplicated tags')
+        with self.assertNumQueries(1):
+            Tag.objects.resolve(['new', 'tag_1'])
+
+
+class PostCreateSerializerTestCase(TestCase):
+    def setUp(self):
+        self.user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+        self.images = [
+            UploadedImage.objects.create(img='img.png', uploaded_by=self.user)
+            for i in range(10)
+        ]
+
+    def get_serializer(self, images, default_image):
+        return PostCreateSerializer(
+            data={
+                'title': 'title',
+                'images': [{'id': str(image_id)} for image_id in images],
+                'default_image': {'id': str(default_image)},
+            },
+            context={'user': self.user},
+        )
+
+    def test_images_are_resolved_in_one_query(self):
+        image_ids = [image.id for image in self.images]
+        serializer = self.get_serializer(image_ids, image_ids[3])
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEquals(
+            serializer.validated_data['default_image'], self.images[3],
+            'bad default image',
+        )
+        post = serializer.save()
+        self.assertEquals(post.images.count(), 10, 'images not attached')
+
+    def test_unknown_image_errors(self):
+        image_ids = [self.images[0].id, uuid.uuid4(), self.images[1].id]
+        serializer = self.get_serializer(image_ids, image_ids[0])
+        self.assertFalse(serializer.is_valid(), 'unknown image accepted')
+        self.assertEquals(
+            serializer.errors['images'],
+            [{}, {'non_field_errors': ['No image with this id']}, {}],
+            'bad item errors',
+        )
+        serializer = self.get_serializer(image_ids[:1], self.images[1].id)
+        self.assertFalse(serializer.is_valid(), 'default not from images')
+
+    def test_foreign_images_errors(self):
+        post = Post.objects.create(created_by=self.user)
+        self.images[1].post = post
+        self.images[1].save()
+        self.images[2].uploaded_by = AuthUser.objects.create_redactor(
+            'other@test.com', 'my_password',
+        )
+        self.images[2].save()
+        image_ids = [image.id for image in self.images[:3]]
+        serializer = self.get_serializer(image_ids, image_ids[0])
+        self.assertFalse(serializer.is_valid(), 'foreign images accepted')
+        self.assertEquals(
+            serializer.errors['images'],
+            [
+                {},
+                {'non_field_errors': ['Image is attached to a post']},
+                {'non_field_errors': ['Image is uploaded by another user']},
+            ],
+            'bad item errors',
+        )
+
+    def test_image_attached_meanwhile(self):
+        image_ids = [image.id for image in self.images[:2]]
+        serializer = self.get_serializer(image_ids, image_ids[0])
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        post = Post.objects.create(created_by=self.user)
+        UploadedImage.objects.filter(id=image_ids[1]).update(post=post)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertEquals(
+            UploadedImage.objects.get(id=image_ids[0]).post_id, None,
+            'image attached by a failed request',
+        )
+
+
+class PostCountsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+
+    def create_post(self, **fields):
+        return Post.objects.create(
+            created_by=self.user, review_status=PostReviewStatus.approved,
+            **fields
+        )
+
+    def create_comment(self, post):
+        response = self.client.post(reverse('api_v1:comment-create'), data={
+            'name': 'name',
+            'email': 'email@example.com',
+            'text': 'text',
+            'post': post.id,
+        })
+        self.assertEquals(response.status_code, 201, 'Can not create comment')
+
+    def test_counts(self):
+        images = [
+            UploadedImage.objects.create(img='img.png', uploaded_by=self.user)
+            for i in range(3)
+        ]
+        serializer = PostCreateSerializer(
+            data={
+                'title': 'title',
+                'images': [{'id': str(image.id)} for image in images],
+                'default_image': {'id': str(images[0].id)},
+            },
+            context={'user': self.user},
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        post = serializer.save()
+        self.assertEquals(post.image_count, 3, 'bad image count')
+
+        stale_post = Post.objects.get(id=post.id)
+        self.create_comment(post)
+        self.create_comment(post)
+        stale_post.title = 'new title'
+        stale_post.save()
+
+        post.refresh_from_db()
+        self.assertEquals(
+            (post.title, post.comment_count, post.image_count),
+            ('new title', 2, 3), 'counters are overwritten by a stale save',
+        )
+        response = self.client.get(
+            reverse('api_v1:post-details', kwargs={'id': post.id}),
+        )
+        self.assertEquals(response.data['comment_count'], 2, 'bad count')
+
+    def test_feed_ordering(self):
+        quiet = self.create_post(title='quiet')
+        self.create_post(title='popular')
+        response = self.client.get(reverse('api_v1:posts-lc'))
+        self.assertEquals(
+            [post['title'] for post in response.data['results']],
+            ['popular', 'quiet'], 'bad default ordering',
+        )
+        self.create_comment(quiet)
+        for data in (
+                {'ordering': 'comments'},
+                {'ordering': 'comments', 'cursor': ''},
+        ):
+            response = self.client.get(reverse('api_v1:posts-lc'), data=data)
+            self.assertEquals(
+                [
+                    (post['title'], post['comment_count'])
+                    for post in response.data['results']
+                ],
+                [('quiet', 1), ('popular', 0)], 'bad ordering by comments',
+            )
+        response = self.client.get(
+            reverse('api_v1:posts-lc'), data={'ordering': 'title'},
+        )
+        self.assertEquals(response.status_code, 400, 'bad ordering accepted')
+
+    def test_reconcile(self):
+        post = self.create_post()
+        Comment.objects.create(
+            name='name', email='email@test.com', text='text', post=post,
+        )
+        UploadedImage.objects.create(img='img.png', post=post)
+        # counts of this one are right
+        self.create_post()
+
+        out = io.StringIO()
+        call_command('reconcile_post_counts', batch_size=1, stdout=out)
+        post.refresh_from_db()
+        self.assertEquals(
+            (post.comment_count, post.image_count), (1, 1), 'not repaired',
+        )
+        self.assertIn('2 checked, 1 repaired', out.getvalue(), 'bad report')
+
+
+class CommentNotificationTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+
+    def test_digest(self):
+        posts = [
+            Post.objects.create(
+                created_by=self.user, title='title',
+                review_status=PostReviewStatus.approved,
+            ) for i in range(2)
+        ]
+        for post in (posts[0], posts[1], posts[0]):
+            response = self.client.post(
+                reverse('api_v1:comment-create'), data={
+                    'name': 'name',
+                    'email': 'email@example.com',
+                    'text': 'text',
+                    'post': post.id,
+                },
+            )
+            self.assertEquals(response.status_code, 201, 'no comment')
+        self.assertEquals(len(mail.outbox), 0, 'email is not delayed')
+        self.assertEquals(
+            PendingCommentNotification.objects.count(), 3, 'not buffered',
+        )
+        self.assertEquals(
+            list(TaskOutbox.objects.values_list('task_name', flat=True)),
+            [send_new_comment_digest.name], 'digest is not scheduled once',
+        )
+
+        send_new_comment_digest(self.user.email)
+        self.assertEquals(len(mail.outbox), 1, 'not one digest')
+        body = mail.outbox[0].body
+        for post in posts:
+            self.assertIn(str(post.id), body, 'post is missing in digest')
+        self.assertFalse(
+            PendingCommentNotification.objects.exists(), 'not cleaned up',
+        )
+        send_new_comment_digest(self.user.email)
+        self.assertEquals(len(mail.outbox), 1, 'sent twice')
+
+    def test_rolled_back_comment(self):
+        try:
+            with transaction.atomic():
+                notify_new_comment('email@example.com', 'http://testserver/')
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        notify_new_comment('email@example.com', 'http://testserver/')
+        self.assertEquals(
+            TaskOutbox.objects.count(), 1, 'flag of a rolled back comment',
+        )
+
+    def test_sweep(self):
+        for recipient in ('first@test.com', 'second@test.com'):
+            PendingCommentNotification.objects.create(
+                recipient=recipient, post_link='http://testserver/post/',
+            )
+        PendingCommentNotification.objects.filter(
+            recipient='first@test.com',
+        ).update(date_created=timezone.now() - timedelta(
+            seconds=settings.COMMENT_NOTIFICATION_WINDOW * 2 + 1,
+        ))
+        sweep_new_comment_digests()
+        self.assertEquals(
+            [msg.to[0] for msg in mail.outbox], ['first@test.com'],
+            'bad swept digests',
+        )
+        self.assertEquals(
+            list(PendingCommentNotification.objects.values_list(
+                'recipient', flat=True,
+            )), ['second@test.com'], 'digest in its window is swept',
+        )
+
+    def test_bulk_digests(self):
+        for recipient in ('first@test.com', 'second@test.com'):
+            PendingCommentNotification.objects.create(
+                recipient=recipient, post_link='http://testserver/post/',
+            )
+        send_new_comment_digests()
+        self.assertEquals(
+            sorted(msg.to[0] for msg in mail.outbox),
+            ['first@test.com', 'second@test.com'], 'digests are not sent',
+        )
+        self.assertFalse(
+            PendingCommentNotification.objects.exists(), 'not cleaned up',
+        )
+
+    def test_failed_email_is_isolated(self):
+        messages = [
+            EmailMessage('subject', 'body', to=['first@test.com']),
+            # header injection is refused by the backend
+            EmailMessage('bad\nsubject', 'body', to=['second@test.com']),
+            EmailMessage('subject', 'body', to=['third@test.com']),
+        ]
+        failed = send_emails(messages)
+        self.assertEquals(failed, [messages[1]], 'bad failed messages')
+        self.assertEquals(
+            [msg.to[0] for msg in mail.outbox],
+            ['first@test.com', 'third@test.com'], 'failure stops the rest',
+        )
+
+
+class TaskDispatcherTestCase(TestCase):
+    def setUp(self):
+        self.connection = TaskDispatcher.connection
+        for patcher in (
+                mock.patch.object(
+                    Signature, 'apply_async',
+                    side_effect=OperationalError('Connection refused'),
+                ),
+                mock.patch.object(
+                    TaskDispatcher, 'connection',
+                    return_value=mock.MagicMock(),
+                ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fallback_is_bounded(self):
+        dispatcher = TaskDispatcher(workers=0, queue_size=1)
+        self.assertFalse(
+            dispatcher.dispatch(send_new_comment_email.name),
+            'task is published to a broken broker',
+        )
+        self.assertTrue(dispatcher.is_broker_down(), 'failure is not seen')
+        with self.assertRaises(queue.Full):
+            dispatcher.dispatch(send_new_comment_email.name)
+        stats = dispatcher.get_stats()
+        self.assertEquals(
+            (stats['fallbacks'], stats['queued']), (1, 1), 'bad stats',
+        )
+
+    def test_fallback_runs_locally(self):
+        dispatcher = TaskDispatcher(
+            workers=1, queue_size=1, retries=2, retry_interval=0,
+        )
+        done = []
+        dispatcher.dispatch(
+            send_new_comment_email.name,
+            args=('email@test.com', 'http://testserver/post/'),
+            callback=lambda: done.append(True),
+        )
+        dispatcher.join()
+        self.assertEquals(len(mail.outbox), 1, 'task is not run locally')
+        self.assertEquals(done, [True], 'callback is not called')
+        self.assertEquals(
+            dispatcher.get_stats(), {
+                'published': 0,
+                'fallbacks': 1,
+                'republished': 0,
+                'requeued': 0,
+                'local': 1,
+                'failed': 0,
+                'queued': 0,
+                'broker_down': False,
+            }, 'bad stats',
+        )
+
+    def test_fallback_waits_for_eta(self):
+        dispatcher = TaskDispatcher(
+            workers=1, queue_size=1, retries=1, retry_interval=0.01,
+        )
+        eta = timezone.now() + timedelta(seconds=0.2)
+        dispatcher.dispatch(
+            send_new_comment_email.name,
+            args=('email@test.com', 'http://testserver/post/'), eta=eta,
+        )
+        dispatcher.join()
+        self.assertEquals(len(mail.outbox), 1, 'task is not run locally')
+        self.assertGreaterEqual(timezone.now(), eta, 'task is run early')
+        self.assertGreater(
+            dispatcher.get_stats()['requeued'], 0, 'task is not requeued',
+        )
+
+    def test_broken_connection_is_broker_down(self):
+        dispatcher = TaskDispatcher(workers=0)
+        with mock.patch.object(
+                app, 'connection_for_write',
+                side_effect=KeyError('No such transport'),
+        ), self.connection(dispatcher) as connection:
+            self.assertIsNone(connection, 'broken connection is used')
+        self.assertTrue(dispatcher.is_broker_down(), 'failure is not seen')
+
+    def test_relay_keeps_queued_tasks(self):
+        tasks = [
+            TaskOutbox.objects.create(task_name=send_new_comment_email.name)
+            for i in range(2)
+        ]
+        with mock.patch.object(
+                outbox_dispatcher, 'dispatch', side_effect=[True, False],
+        ) as dispatch:
+            self.assertEquals(relay_outbox(), 2, 'bad dispatched count')
+        self.assertEquals(
+            list(TaskOutbox.objects.values_list('id', flat=True)),
+            [tasks[1].id], 'queued task is deleted or published one is kept',
+        )
+        self.assertIsNotNone(
+            TaskOutbox.objects.get().claimed_until, 'queued task is unclaimed',
+        )
+        self.assertEquals(relay_outbox(), 0, 'claimed task is dispatched')
+
+        # the fallback thread deletes the task when it is done
+        dispatch.call_args[1]['callback']()
+        self.assertFalse(TaskOutbox.objects.exists(), 'done task is kept')
+
+
+@override_settings(THROTTLE_BUCKETS=dict(
+    settings.THROTTLE_BUCKETS, comment_post=(1, 0.001),
+))
+class CommentThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = AuthUser.objects.create_redactor(
+            'email@test.com', 'my_password',
+        )
+        self.posts = [
+            Post.objects.create(
+                created_by=user, title='title',
+                review_status=PostReviewStatus.approved,
+            ) for i in range(2)
+        ]
+
+    def comment(self, post):
+        return self.client.post(reverse('api_v1:comment-create'), data={
+            'name': 'name',
+            'email': 'email@example.com',
+            'text': 'text',
+            'post': post.id,
+        })
+
+    def test_post_bucket(self):
+        self.assertEquals(self.comment(self.posts[0]).status_code, 201)
+        with self.assertNumQueries(0):
+            response = self.comment(self.posts[0])
+        self.assertEquals(response.status_code, 429, 'not throttled')
+        self.assertEquals(
+            self.comment(self.posts[1]).status_code, 201,
+            'other post is throttled',
+        )
@@ -1,16 +1,76 @@
+from collections import OrderedDict
+
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import status, serializers
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 
-from api.models import Post, PostReviewStatus
+from api.cache import get_feed_cache_key, get_post_cache_key, \
+    get_cached_response, set_cached_response, get_etag, get_feed_modified, \
+    get_post_version, get_post_modified, set_post_modified
+from api.models import Post, PostReviewStatus, Comment
 from api.v1.model_serializers import FullPostSerializer, ShortPostSerializer, \
     CommentSerializer, UploadedImageSerializer
+from api.v1.pagination import KeysetPagination, KeysetCursorPagination
 from api.v1.permissions import IsSignedIn
+from api.v1.throttling import CommentThrottle
 from api.v1.post.serializers import PostCreateSerializer
-from planekstest.tasks import send_new_comment_email
+from planekstest.tasks import notify_new_comment
+
+# orderings of the public feed, each one is served by an index
+FEED_ORDERINGS = OrderedDict((
+    ('date', ('-date_published', '-id')),
+    ('comments', ('-comment_count', '-date_published', '-id')),
+))
+
+
+def get_cached_json_response(request, key, name):
+    if request.accepted_renderer.format != 'json':
+        return None
+    content = get_cached_response(key, name)
+    if content is not None:
+        return HttpResponse(content, content_type='application/json')
+
+
+def cache_json_response(request, response, key, timeout):
+    if request.accepted_renderer.format == 'json':
+        response.add_post_render_callback(
+            lambda rendered: set_cached_response(
+                key, rendered.content, timeout,
+            )
+        )
+    return response
+
+
+def get_not_modified_response(request, etag, get_last_modified):
+    """
+    Returns `304` if client has the current version, before any rendering.
+    get_last_modified is called only if the request asks for it.
+    """
+    meta = request.META
+    last_modified = None
+    if 'HTTP_IF_MODIFIED_SINCE' in meta or \
+            'HTTP_IF_UNMODIFIED_SINCE' in meta:
+        last_modified = get_last_modified()
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified,
+    )
+    if response is not None:
+        set_conditional_headers(response, etag, last_modified)
+    return response
+
+
+def set_conditional_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
 
 
 def get_post_or_404(id, user, check_own=True):
@@ -68,15 +128,9 @@ class PostArchiveView(GenericAPIView):
         )
 
 
-class MyLimitOffsetPagination(LimitOffsetPagination):
-    # move pagination to utils
-    max_limit = 100
-    default_limit = 12
-
-
 class PostListCreateView(GenericAPIView):
     serializer_class = ShortPostSerializer
-    pagination_class = MyLimitOffsetPagination
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -94,33 +148,64 @@ class PostListCreateView(GenericAPIView):
             pagination:
                 `limit` - page size, max value 100, default 12
                 `offset` - results offset
+                `cursor` - opaque cursor from `next`/`previous` links,
+                    send it empty to get the first page
             `posts/?limit=50` - returns first 50 items
             `posts/?limit=50&offset=50` - returns 51..100 items
+            `posts/?limit=50&cursor=` - returns first 50 items and
+                a `next` link, page cost doesn't depend on its depth
+
+            ordering of the public feed:
+                `ordering=date` - newest first, default
+                `ordering=comments` - most commented first
         """
         user = request.user
+        cache_key = None
+        ordering = request.query_params.get('ordering', 'date')
+        if ordering not in FEED_ORDERINGS:
+            raise ValidationError({
+                'ordering': ['One of: %s' % ', '.join(FEED_ORDERINGS)],
+            })
         if not user.is_anonymous and user.is_redactor:
             queryset = Post.objects.filter(
                 created_by=user
-            )
+            ).order_by('-date_created', '-id')
         elif not user.is_anonymous and user.is_staff:
             queryset = Post.objects.filter(
                 created_by=user
-            )
+            ).order_by('-date_created', '-id')
         else:
+            # public feed is the same for everyone, serve rendered json
+            cache_key = get_feed_cache_key(request)
+            etag = get_etag(cache_key, request.accepted_renderer.format)
+            response = get_not_modified_response(
+                request, etag, get_feed_modified,
+            ) or get_cached_json_response(request, cache_key, 'feed')
+            if response is not None:
+                return set_conditional_headers(
+                    response, etag, get_feed_modified(),
+                )
             queryset = Post.objects.filter(
                 review_status=PostReviewStatus.approved
-            )
+            ).order_by(*FEED_ORDERINGS[ordering])
 
-        posts = queryset
+        serializer_class = self.get_serializer_class()
+        posts = serializer_class.setup_eager_loading(queryset)
         paginated_posts = self.paginator.paginate_queryset(
             posts, request,
         )
-        serializer_class = self.get_serializer_class()
         posts_data = serializer_class(
             paginated_posts, many=True, context={'request': request},
         ).data
 
-        return self.paginator.get_paginated_response(posts_data)
+        response = self.paginator.get_paginated_response(posts_data)
+        if cache_key is not None:
+            cache_json_response(
+                request, response, cache_key,
+                settings.POSTS_FEED_CACHE_TIMEOUT,
+            )
+            set_conditional_headers(response, etag, get_feed_modified())
+        return response
 
     def post(self, request):
         """ Create new post  """
@@ -143,9 +228,32 @@ class PostDetailsView(GenericAPIView):
     def get(self, request, id):
         """
         Get full info about post
+
+        Supports conditional requests with `If-None-Match` (`ETag`)
+        and `If-Modified-Since` (`Last-Modified`)
         """
+        # /posts/007 must share the keys invalidated by saves of post 7
+        id = int(id)
+        # a version is made only for existing posts, so requests of
+        # missing ids don't fill the cache
+        version = get_post_version(id, create=False)
+        if version is None:
+            if not Post.objects.filter(id=id).exists():
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            version = get_post_version(id)
+        cache_key = get_post_cache_key(request, id, version)
+        etag = get_etag(cache_key, request.accepted_renderer.format)
+        response = get_not_modified_response(
+            request, etag, lambda: get_post_modified(id, version),
+        ) or get_cached_json_response(request, cache_key, 'post')
+        if response is not None:
+            return set_conditional_headers(
+                response, etag, get_post_modified(id, version),
+            )
+
+        queryset = self.serializer_class.setup_eager_loading(Post.objects)
         try:
-            post = Post.objects.get(id=id)
+            post = queryset.get(id=id)
         except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -153,11 +261,39 @@ class PostDetailsView(GenericAPIView):
             post, context={'request': request},
         ).data
 
-        return Response(serializer_data, status=status.HTTP_200_OK)
+        response = cache_json_response(
+            request, Response(serializer_data, status=status.HTTP_200_OK),
+            cache_key, settings.POSTS_DETAIL_CACHE_TIMEOUT,
+        )
+        return set_conditional_headers(
+            response, etag, set_post_modified(id, version, post.date_modified),
+        )
+
+
+class PostCommentListView(GenericAPIView):
+    serializer_class = CommentSerializer
+    pagination_class = KeysetCursorPagination
+
+    def get(self, request, id):
+        """
+        Get comments of post
+
+        Newest first, pages are linked by `next`/`previous`.
+        `limit` - page size, max value 100, default 12
+        """
+        if not Post.objects.filter(id=id).exists():
+            raise Http404()
+        comments = self.paginate_queryset(
+            Comment.objects.filter(post_id=id).order_by('-date_created', '-id')
+        )
+        return self.get_paginated_response(
+            self.get_serializer(comments, many=True).data
+        )
 
 
 class CommentCreateView(GenericAPIView):
     serializer_class = CommentSerializer
+    throttle_classes = (CommentThrottle,)
 
     def post(self, request):
         """
@@ -171,11 +307,12 @@ class CommentCreateView(GenericAPIView):
             data=request.data,
         )
         serial.is_valid(raise_exception=True)
-        comment = serial.save()
-        comment.post = post
-        comment.save()
-        post_link = post.get_url(request)
-        send_new_comment_email.delay(post.created_by.email, post_link)
+        with transaction.atomic():
+            comment = serial.save()
+            comment.post = post
+            comment.save()
+            Post.objects.add_counts(post.id, comments=1)
+            notify_new_comment(post.created_by.email, post.get_url(request))
         serializer_data = self.serializer_class(
             instance=comment, context={'request': request},
         ).data
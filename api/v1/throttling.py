@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from api.models import AuthUser
+
+__all__ = (
+    'take_tokens',
+    'LoginThrottle',
+    'RegistrationThrottle',
+    'CommentThrottle',
+)
+
+BUCKET_KEY = 'throttle:%s:%s'
+
+# KEYS are buckets, ARGV are capacity and rate of each bucket, then now.
+# A token is taken from every bucket or, if one is empty, from none.
+# Returns 1 or 0 and seconds until the emptiest bucket has a token
+TAKE_TOKENS_SCRIPT = """
+local now = tonumber(ARGV[#ARGV])
+local buckets = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'time')
+    local tokens = tonumber(bucket[1]) or capacity
+    local last = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    buckets[i] = {tokens, capacity / rate}
+end
+for i, key in ipairs(KEYS) do
+    local tokens = buckets[i][1]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HMSET', key, 'tokens', tostring(tokens), 'time', ARGV[#ARGV])
+    redis.call('EXPIRE', key, math.ceil(buckets[i][2]) + 1)
+end
+if wait == 0 then
+    return {1, '0'}
+end
+return {0, tostring(wait)}
+"""
+
+_script = None
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = redis.StrictRedis.from_url(
+            settings.THROTTLE_REDIS_URL,
+            socket_timeout=settings.THROTTLE_REDIS_TIMEOUT,
+            socket_connect_timeout=settings.THROTTLE_REDIS_TIMEOUT,
+        ).register_script(TAKE_TOKENS_SCRIPT)
+    return _script
+
+
+def _take_tokens_redis(buckets, now):
+    args = []
+    for _, capacity, rate in buckets:
+        args.extend((capacity, rate))
+    args.append(repr(now))
+    allowed, wait = _get_script()(
+        keys=[key for key, _, _ in buckets], args=args,
+    )
+    return bool(allowed), float(wait)
+
+
+def _take_tokens_cache(buckets, now):
+    # not atomic, for tests and a single process
+    states = cache.get_many([key for key, _, _ in buckets])
+    refilled = []
+    wait = 0
+    for key, capacity, rate in buckets:
+        tokens, last = states.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0, now - last) * rate)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+        refilled.append((key, tokens, capacity / rate))
+    for key, tokens, timeout in refilled:
+        if wait == 0:
+            tokens -= 1
+        cache.set(key, (tokens, now), int(timeout) + 1)
+    return wait == 0, wait
+
+
+def take_tokens(buckets):
+    """
+    Takes a token from every bucket, atomically if THROTTLE_REDIS_URL is set
+    :param buckets: list of (bucket name, identity) of THROTTLE_BUCKETS
+    :return: (True, 0) if taken, else (False, seconds to wait)
+    """
+    now = time.time()
+    buckets = [
+        (
+            BUCKET_KEY % (name, hashlib.md5(
+                str(ident).encode('utf-8'),
+            ).hexdigest()),
+        ) + tuple(settings.THROTTLE_BUCKETS[name])
+        for name, ident in buckets
+    ]
+    if not settings.THROTTLE_REDIS_URL:
+        return _take_tokens_cache(buckets, now)
+    try:
+        return _take_tokens_redis(buckets, now)
+    except Exception:
+        # throttling must not take the site down with it
+        logging.exception('Throttling is off, Redis failed')
+        return True, 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token buckets checked before the view, so a throttled request
+    costs no password hashing and no queries
+    """
+
+    def get_buckets(self, request, view):
+        """
+        List of (bucket name, identity), None identities are skipped
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if request.method == 'OPTIONS':
+            return True
+        buckets = [
+            (name, ident)
+            for name, ident in self.get_buckets(request, view)
+            if ident is not None
+        ]
+        if not buckets:
+            return True
+        allowed, self.wait_seconds = take_tokens(buckets)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def _get_data(request, name):
+    try:
+        value = request.data.get(name)
+    except AttributeError:
+        return None
+    return value or None
+
+
+class LoginThrottle(TokenBucketThrottle):
+    def get_buckets(self, request, view):
+        email = _get_data(request, 'email')
+        if email is not None:
+            email = AuthUser.objects.normalize_email(str(email))
+        return [
+            ('login_ip', self.get_ident(request)),
+            ('login_account', email),
+        ]
+
+
+class RegistrationThrottle(TokenBucketThrottle):
+    def get_buckets(self, request, view):
+        return [('register_ip', self.get_ident(request))]
+
+
+class CommentThrottle(TokenBucketThrottle):
+    def get_buckets(self, request, view):
+        return [
+            ('comment_ip', self.get_ident(request)),
+            ('comment_post', _get_data(request, 'post')),
+        ]
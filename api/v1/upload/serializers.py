@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.validators import MaxValueValidator
+from rest_framework import serializers
+
+from api.models import ImageUploadSession, image_upload_to
+
+
+class ImageUploadSessionSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=100, write_only=True)
+    size = serializers.IntegerField(
+        min_value=1,
+        validators=[MaxValueValidator(settings.IMAGE_UPLOAD_MAX_SIZE)],
+    )
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = ImageUploadSession
+        fields = (
+            'id',
+            'name',
+            'size',
+            'offset',
+        )
+
+        extra_kwargs = {
+            'id': {'read_only': True},
+        }
+
+    def create(self, validated_data):
+        name = validated_data.pop('name')
+        validated_data['file_name'] = image_upload_to(None, name)
+        return super(ImageUploadSessionSerializer, self).create(validated_data)
@@ -0,0 +1,479 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.core.management import call_command
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.images import create_uploaded_image, get_upload_session_path
+from api.models import AuthUser, ImageUploadSession, UploadedImage, \
+    ImageBlob, Post
+from api.storage import images_storage
+from api.utils import test_file
+from api.v1.model_serializers import UploadedImageSerializer
+from planekstest.tasks import generate_image_derivatives, \
+    collect_image_garbage
+
+SHARDED_NAME_RE = re.compile(r'^uploaded_images/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+
+
+class MemoryStorage(Storage):
+    """
+    Remote storage stand-in, it has no local paths
+    """
+    files = {}
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.files[name], name=name)
+
+    def _save(self, name, content):
+        self.files[name] = b''.join(content.chunks())
+        return name
+
+    def exists(self, name):
+        return name in self.files
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+    def size(self, name):
+        return len(self.files[name])
+
+    def url(self, name):
+        return 'http://storage.test/' + name
+
+
+class ImageUploadSessionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_UPLOAD_SESSIONS_DIR=os.path.join(self.media_root, 'sessions'),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        AuthUser.objects.create_redactor(
+            email='email@test.com', password='my_password',
+            first_name='FirstName', last_name='LastName',
+        )
+        self.client = APIClient()
+        response = self.client.post(reverse('api_v1:login'), data={
+            'email': 'email@test.com',
+            'password': 'my_password',
+        })
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['token'])
+        with test_file() as file:
+            self.content = file.read()
+            image = Image.open(file)
+            self.width, self.height = image.size
+            self.format = image.format
+
+    def start(self, content):
+        response = self.client.post(
+            reverse('api_v1:upload-session-create'),
+            data={'name': 'image.png', 'size': len(content)},
+        )
+        self.assertEquals(response.status_code, 201, 'Can not start upload')
+        self.assertEquals(response.data['offset'], 0, 'Wrong start offset')
+        return response.data['id']
+
+    def put(self, session_id, content, first, size=None):
+        return self.client.put(
+            reverse('api_v1:upload-session', kwargs={'id': session_id}),
+            data=content, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %s-%s/%s' % (
+                first, first + len(content) - 1, size or len(self.content),
+            ),
+        )
+
+    def finalize(self, session_id):
+        return self.client.post(reverse(
+            'api_v1:upload-session-finalize', kwargs={'id': session_id},
+        ))
+
+    def test_upload_by_chunks(self):
+        session_id = self.start(self.content)
+        middle = len(self.content) // 2
+
+        response = self.put(session_id, self.content[:middle], 0)
+        self.assertEquals(response.status_code, 200, 'Can not upload chunk')
+        response = self.client.get(
+            reverse('api_v1:upload-session', kwargs={'id': session_id}),
+        )
+        self.assertEquals(response.data['offset'], middle, 'Wrong offset')
+
+        response = self.finalize(session_id)
+        self.assertEquals(response.status_code, 400, 'Finalized partial upload')
+
+        response = self.put(session_id, self.content[middle:], middle)
+        self.assertEquals(response.status_code, 200, 'Can not upload chunk')
+        self.assertEquals(response.data['offset'], len(self.content), 'Wrong offset')
+
+        response = self.finalize(session_id)
+        self.assertEquals(response.status_code, 201, 'Can not finalize upload')
+        self.assertEquals(
+            (response.data['width'], response.data['height'],
+             response.data['format'], response.data['byte_size']),
+            (self.width, self.height, self.format, len(self.content)),
+            'Wrong metadata',
+        )
+        image = UploadedImage.objects.get(id=response.data['id'])
+        with image.img.open() as file:
+            self.assertEquals(file.read(), self.content, 'File is corrupted')
+        self.assertFalse(
+            ImageUploadSession.objects.exists(), 'Session is not deleted',
+        )
+
+    def test_upload_wrong_offset(self):
+        session_id = self.start(self.content)
+        response = self.put(session_id, self.content[10:], 10)
+        self.assertEquals(response.status_code, 409, 'Chunk with gap accepted')
+        self.assertEquals(response.data['offset'], 0, 'Wrong offset')
+
+        response = self.put(session_id, self.content, 0, size=len(self.content) + 1)
+        self.assertEquals(response.status_code, 416, 'Wrong size accepted')
+
+    def test_upload_not_image(self):
+        content = b'not an image' * 10
+        session_id = self.start(content)
+        response = self.put(session_id, content, 0, size=len(content))
+        self.assertEquals(response.status_code, 200, 'Can not upload chunk')
+        response = self.finalize(session_id)
+        self.assertEquals(response.status_code, 400, 'Not image accepted')
+        self.assertFalse(UploadedImage.objects.exists(), 'Image is created')
+
+    def test_upload_session_of_other_user(self):
+        session_id = self.start(self.content)
+        self.client.credentials()
+        AuthUser.objects.create_redactor(
+            email='other@test.com', password='my_password',
+            first_name='FirstName', last_name='LastName',
+        )
+        response = self.client.post(reverse('api_v1:login'), data={
+            'email': 'other@test.com',
+            'password': 'my_password',
+        })
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['token'])
+        response = self.put(session_id, self.content, 0)
+        self.assertEquals(response.status_code, 404, 'Foreign session accepted')
+
+    def test_finalize_moves_file(self):
+        session_id = self.start(self.content)
+        self.put(session_id, self.content, 0)
+        inode = os.stat(get_upload_session_path(session_id)).st_ino
+        response = self.finalize(session_id)
+        self.assertEquals(response.status_code, 201, 'Can not finalize upload')
+        image = UploadedImage.objects.get(id=response.data['id'])
+        self.assertRegex(image.img.name, SHARDED_NAME_RE, 'Name is not sharded')
+        self.assertEquals(
+            os.stat(image.img.path).st_ino, inode, 'File is copied',
+        )
+        self.assertFalse(
+            os.path.exists(get_upload_session_path(session_id)),
+            'Session file is left',
+        )
+
+    @override_settings(UPLOADED_IMAGES_STORAGE='api.v1.upload.tests.MemoryStorage')
+    def test_upload_to_remote_storage(self):
+        MemoryStorage.files = {}
+        session_id = self.start(self.content)
+        self.put(session_id, self.content, 0)
+        response = self.finalize(session_id)
+        self.assertEquals(response.status_code, 201, 'Can not finalize upload')
+        image = UploadedImage.objects.get(id=response.data['id'])
+        self.assertRegex(image.img.name, SHARDED_NAME_RE, 'Name is not sharded')
+        self.assertEquals(
+            MemoryStorage.files, {image.img.name: self.content},
+            'Image is not in the storage',
+        )
+
+    def test_same_content_is_stored_once(self):
+        image_ids = [
+            self.client.post(
+                reverse('api_v1:upload-image'), data={'img': test_file()},
+            ).data['id']
+            for _ in range(2)
+        ]
+        session_id = self.start(self.content)
+        self.put(session_id, self.content, 0)
+        image_ids.append(self.finalize(session_id).data['id'])
+
+        self.assertEquals(len(set(image_ids)), 3, 'Image ids are not distinct')
+        self.assertEquals(
+            set(UploadedImage.objects.values_list('width', 'height', 'format')),
+            {(self.width, self.height, self.format)}, 'Wrong metadata',
+        )
+        blob = ImageBlob.objects.get()
+        self.assertEquals(blob.ref_count, 3, 'Wrong reference count')
+        self.assertEquals(
+            set(UploadedImage.objects.values_list('img', flat=True)),
+            {blob.name}, 'Content is stored more than once',
+        )
+
+        UploadedImage.objects.filter(id__in=image_ids[:2]).delete()
+        blob.refresh_from_db()
+        self.assertEquals(blob.ref_count, 1, 'Reference is not released')
+        UploadedImage.objects.get(id=image_ids[2]).delete()
+        self.assertFalse(ImageBlob.objects.exists(), 'Unused blob is kept')
+
+
+@override_settings(IMAGE_DERIVATIVE_WIDTHS=(100, 400, 1000))
+class ImageDerivativeTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    @staticmethod
+    def create_image(size, mode='RGB', format='JPEG'):
+        content = io.BytesIO()
+        Image.new(mode, size).save(content, format)
+        image = UploadedImage(uploaded_by=None)
+        image.img.save('image.' + format.lower(), ContentFile(content.getvalue()))
+        return image
+
+    def get_srcset(self, image):
+        request = RequestFactory().get('/')
+        image = UploadedImage.objects.get(id=image.id)
+        return UploadedImageSerializer(
+            instance=image, context={'request': request},
+        ).data['srcset']
+
+    def test_derivatives(self):
+        image = self.create_image((800, 600))
+        self.assertEquals(
+            list(self.get_srcset(image)), ['original'], 'Original is not used',
+        )
+
+        generate_image_derivatives(str(image.id))
+        derivatives = list(image.derivatives.all())
+        self.assertEquals(
+            [derivative.width for derivative in derivatives], [100, 400],
+            'Wrong derivatives, original must not be enlarged',
+        )
+        with Image.open(derivatives[1].img.path) as derivative:
+            self.assertEquals(derivative.size, (400, 300), 'Wrong size')
+            self.assertEquals(derivative.format, 'JPEG', 'Wrong format')
+        self.assertEquals(
+            list(self.get_srcset(image)), ['100w', '400w', 'original'],
+            'Derivatives are not shown',
+        )
+
+        generate_image_derivatives(str(image.id))
+        self.assertEquals(image.derivatives.count(), 2, 'Duplicated derivatives')
+
+    def test_derivatives_of_same_content(self):
+        content = io.BytesIO()
+        Image.new('RGB', (800, 600)).save(content, 'JPEG')
+        images = [
+            create_uploaded_image(
+                ContentFile(content.getvalue(), name='image.jpg'),
+            ) for _ in range(2)
+        ]
+        generate_image_derivatives(str(images[0].id))
+        with mock.patch.object(
+                UploadedImage.img.field.storage, 'open',
+                side_effect=AssertionError('file of a duplicate is read'),
+        ):
+            generate_image_derivatives(str(images[1].id))
+        blob = ImageBlob.objects.get()
+        self.assertEquals(
+            list(blob.derivatives.values_list('width', flat=True)), [100, 400],
+            'Derivatives are not made once per content',
+        )
+        self.assertEquals(
+            list(self.get_srcset(images[1])), ['100w', '400w', 'original'],
+            'Derivatives of the content are not shown',
+        )
+
+    def test_transparent_derivatives(self):
+        image = self.create_image((500, 500), mode='RGBA', format='PNG')
+        generate_image_derivatives(str(image.id))
+        derivative = image.derivatives.first()
+        with Image.open(derivative.img.path) as derivative:
+            self.assertEquals(derivative.format, 'PNG', 'Transparency is lost')
+
+
+class ShardUploadedImagesTestCase(TestCase):
+    def setUp(self):
+        self.content = b'content'
+
+    def create_flat_images(self):
+        images = []
+        for index in range(3):
+            name = images_storage.save(
+                'uploaded_images/%s_image.png' % index,
+                ContentFile(self.content),
+            )
+            images.append(UploadedImage.objects.create(img=name))
+        return images
+
+    def assertSharded(self, images, old_names):
+        for image, old_name in zip(images, old_names):
+            image.refresh_from_db()
+            self.assertRegex(image.img.name, SHARDED_NAME_RE, 'Not sharded')
+            self.assertFalse(images_storage.exists(old_name), 'Old file kept')
+            with image.img.open() as file:
+                self.assertEquals(file.read(), self.content, 'File is lost')
+
+    def shard(self):
+        call_command(
+            'shard_uploaded_images', batch_size=2, workers=2, stdout=io.StringIO(),
+        )
+
+    def test_shard_local_storage(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            images = self.create_flat_images()
+            old_names = [image.img.name for image in images]
+            self.shard()
+            self.assertSharded(images, old_names)
+            # repeated run changes nothing
+            self.shard()
+            self.assertSharded(images, old_names)
+
+    @override_settings(UPLOADED_IMAGES_STORAGE='api.v1.upload.tests.MemoryStorage')
+    def test_shard_remote_storage(self):
+        MemoryStorage.files = {}
+        images = self.create_flat_images()
+        old_names = [image.img.name for image in images]
+        self.shard()
+        self.assertSharded(images, old_names)
+        self.assertEquals(len(MemoryStorage.files), 3, 'Files are copied')
+
+
+class BackfillImageMetadataTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def test_backfill(self):
+        content = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(content, 'JPEG')
+        images = [
+            UploadedImage.objects.create(img=images_storage.save(
+                'uploaded_images/image.jpg', ContentFile(content.getvalue()),
+            ))
+            for _ in range(2)
+        ]
+        broken = UploadedImage.objects.create(img=images_storage.save(
+            'uploaded_images/broken.jpg', ContentFile(b'broken'),
+        ))
+
+        call_command(
+            'backfill_image_metadata', batch_size=2, workers=1,
+            stdout=io.StringIO(),
+        )
+        for image in images:
+            image.refresh_from_db()
+            self.assertEquals(
+                (image.width, image.height, image.format, image.byte_size),
+                (30, 20, 'JPEG', len(content.getvalue())), 'Wrong metadata',
+            )
+        self.assertEquals(
+            images[0].img.name, images[1].img.name, 'Same content is not shared',
+        )
+        self.assertEquals(ImageBlob.objects.get().ref_count, 2, 'Wrong count')
+        broken.refresh_from_db()
+        self.assertIsNone(broken.width, 'Broken image is filled')
+
+
+class ImageGarbageCollectionTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_UPLOAD_SESSIONS_DIR=os.path.join(self.media_root, 'sessions'),
+            IMAGE_GC_BATCH_SIZE=2,
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.old = timezone.now() - timedelta(days=2)
+
+    def create_image(self, content, **fields):
+        image = create_uploaded_image(
+            ContentFile(content, name='image.png'), **fields
+        )
+        UploadedImage.objects.filter(id=image.id).update(date_created=self.old)
+        return image
+
+    def create_file(self, name, content, old=True):
+        name = images_storage.save(name, ContentFile(content))
+        if old:
+            timestamp = time.time() - 2 * 24 * 60 * 60
+            os.utime(images_storage.path(name), (timestamp, timestamp))
+        return name
+
+    def test_collect_garbage(self):
+        post = Post.objects.create(title='post')
+        attached = self.create_image(b'attached', post=post)
+        default = self.create_image(b'default')
+        post.default_image = default
+        post.save()
+        [
+            self.create_image(('unattached %s' % i).encode())
+            for i in range(3)
+        ]
+        # its blob is still referenced by the attached one
+        self.create_image(b'attached')
+        fresh = create_uploaded_image(ContentFile(b'fresh', name='image.png'))
+
+        stray = self.create_file('uploaded_images/ab/cd/stray.png', b'stray')
+        fresh_stray = self.create_file(
+            'uploaded_images/ab/cd/fresh.png', b'fresh stray', old=False,
+        )
+
+        session = ImageUploadSession.objects.create(
+            uploaded_by=AuthUser.objects.create_redactor(
+                email='email@test.com', password='my_password',
+                first_name='FirstName', last_name='LastName',
+            ),
+            file_name='uploaded_images/image.png', size=100, received=7,
+        )
+        ImageUploadSession.objects.filter(id=session.id).update(
+            date_created=self.old,
+        )
+        os.makedirs(os.path.dirname(get_upload_session_path(session.id)))
+        with open(get_upload_session_path(session.id), 'wb') as file:
+            file.write(b'session')
+
+        stats = collect_image_garbage()
+        self.assertEquals(
+            stats, {
+                'images': 4, 'files': 1, 'sessions': 1,
+                'bytes': len(b'unattached 0') * 3 + len(b'stray') + len(b'session'),
+            }, 'Wrong stats',
+        )
+        self.assertEquals(
+            set(UploadedImage.objects.values_list('id', flat=True)),
+            {attached.id, default.id, fresh.id}, 'Wrong images are deleted',
+        )
+        self.assertFalse(images_storage.exists(stray), 'Stray file is kept')
+        self.assertTrue(images_storage.exists(fresh_stray), 'Fresh file is lost')
+        self.assertFalse(ImageUploadSession.objects.exists(), 'Session is kept')
+        self.assertFalse(
+            os.path.exists(get_upload_session_path(session.id)),
+            'Session chunks are kept',
+        )
@@ -0,0 +1,173 @@
+import os
+import re
+
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.http import Http404
+from rest_framework import status
+from rest_framework.generics import GenericAPIView
+from rest_framework.response import Response
+
+from api.images import get_upload_session_path, write_chunk, \
+    get_image_metadata, get_content_hash, acquire_blob, store_local_file
+from api.models import ImageUploadSession, UploadedImage
+from api.v1.model_serializers import UploadedImageSerializer
+from api.v1.permissions import IsSignedIn
+from api.v1.upload.serializers import ImageUploadSessionSerializer
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def get_session_or_404(id, user):
+    try:
+        return ImageUploadSession.objects.get(id=id, uploaded_by=user)
+    except (ObjectDoesNotExist, ValidationError):
+        raise Http404()
+
+
+class ImageUploadSessionCreateView(GenericAPIView):
+    serializer_class = ImageUploadSessionSerializer
+    permission_classes = (IsSignedIn,)
+
+    def post(self, request):
+        """
+        Start resumable image upload
+
+        Send `name` and `size` of the image, then PUT its bytes to the
+        session in chunks and finalize it
+        """
+        serial = self.serializer_class(data=request.data)
+        serial.is_valid(raise_exception=True)
+        session = serial.save(uploaded_by=request.user)
+        return Response(
+            self.serializer_class(instance=session).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ImageUploadSessionView(GenericAPIView):
+    serializer_class = ImageUploadSessionSerializer
+    permission_classes = (IsSignedIn,)
+
+    def get(self, request, id):
+        """
+        Get upload session
+
+        `offset` is the count of received bytes, resume upload from it
+        """
+        session = get_session_or_404(id, request.user)
+        return Response(self.serializer_class(instance=session).data)
+
+    def put(self, request, id):
+        """
+        Upload image chunk
+
+        Body is raw bytes of the chunk, header
+        `Content-Range: bytes <first>-<last>/<size>` gives its position.
+        `first` must be equal to the session `offset`, else `409` with the
+        session is returned. If the connection breaks, the received part of
+        the chunk is kept.
+        """
+        session = get_session_or_404(id, request.user)
+        match = CONTENT_RANGE_RE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if match is None:
+            return Response(
+                {'detail': 'Content-Range header is required'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        first, last, size = (int(value) for value in match.groups())
+        if size != session.size or first > last or last >= size:
+            return Response(
+                {'detail': 'Content-Range does not match the upload'},
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            )
+        if first != session.received:
+            return Response(
+                self.serializer_class(instance=session).data,
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        written = 0
+        if request.stream is not None:
+            written = write_chunk(
+                get_upload_session_path(session.id), first, request.stream, last - first + 1,
+            )
+        # compare-and-set: a concurrent PUT of the same chunk moves it once
+        updated = ImageUploadSession.objects.filter(
+            id=session.id, received=first,
+        ).update(received=first + written)
+        if not updated:
+            session.refresh_from_db()
+            return Response(
+                self.serializer_class(instance=session).data,
+                status=status.HTTP_409_CONFLICT,
+            )
+        session.received = first + written
+        return Response(self.serializer_class(instance=session).data)
+
+
+class ImageUploadSessionFinalizeView(GenericAPIView):
+    serializer_class = UploadedImageSerializer
+    permission_classes = (IsSignedIn,)
+
+    def post(self, request, id):
+        """
+        Finalize image upload
+
+        Checks the received file once and creates the uploaded image
+        """
+        session = get_session_or_404(id, request.user)
+        if session.received != session.size:
+            return Response(
+                {'detail': 'Upload is not complete'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        path = get_upload_session_path(session.id)
+        try:
+            file = File(open(path, 'rb'))
+        except FileNotFoundError:
+            # finalized by a concurrent request
+            raise Http404()
+        with file:
+            metadata = get_image_metadata(file)
+            if metadata is not None:
+                # chunks come in separate requests, so it is hashed here
+                image = self.create_image(
+                    session, path, get_content_hash(file), metadata,
+                )
+            else:
+                image = None
+                session.delete()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # moved to the storage
+            pass
+        if image is None:
+            return Response(
+                {'detail': 'Uploaded file is not an image'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            self.serializer_class(
+                instance=image, context={'request': request}
+            ).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def create_image(session, path, content_hash, metadata):
+        deleted, _ = ImageUploadSession.objects.filter(id=session.id).delete()
+        if not deleted:
+            raise Http404()
+        blob = acquire_blob(
+            content_hash, session.size,
+            # moved, not copied: no second write of a large upload
+            lambda: store_local_file(path, session.file_name),
+        )
+        return UploadedImage.objects.create(
+            uploaded_by=session.uploaded_by, img=blob.name, blob=blob,
+            byte_size=session.size, **metadata
+        )
@@ -1,9 +1,11 @@
 from django.conf.urls import url
 
 from api.v1.post.views import PostListCreateView, PostDetailsView, \
-    CommentCreateView, PostArchiveView, ImageUploadView
+    CommentCreateView, PostArchiveView, ImageUploadView, PostCommentListView
 from api.v1.auth.views import LoginView, RefreshTokenView, \
     VerifyTokenView, RegistrationView
+from api.v1.upload.views import ImageUploadSessionCreateView, \
+    ImageUploadSessionView, ImageUploadSessionFinalizeView
 
 urlpatterns = [
     url(r'^register/?$', RegistrationView.as_view(), name='register'),
@@ -11,6 +13,19 @@ urlpatterns = [
     url(r'^token/refresh/?$', RefreshTokenView.as_view(), name='refresh-token'),
     url(r'^token/verify/?$', VerifyTokenView.as_view(), name='verify-token'),
     url(r'^upload-image/?$', ImageUploadView.as_view(), name='upload-image'),
+    url(
+        r'^upload-image/sessions/?$', ImageUploadSessionCreateView.as_view(),
+        name='upload-session-create'
+    ),
+    url(
+        r'^upload-image/sessions/(?P<id>[0-9a-f-]+)/?$',
+        ImageUploadSessionView.as_view(), name='upload-session'
+    ),
+    url(
+        r'^upload-image/sessions/(?P<id>[0-9a-f-]+)/finalize/?$',
+        ImageUploadSessionFinalizeView.as_view(),
+        name='upload-session-finalize'
+    ),
     url(r'^posts/?$', PostListCreateView.as_view(), name='posts-lc'),
     url(
         r'^posts/(?P<id>\d+)/?$', PostDetailsView.as_view(),
@@ -20,6 +35,10 @@ urlpatterns = [
         r'^posts/(?P<id>\d+)/archive/?$', PostArchiveView.as_view(),
         name='post-archive'
     ),
+    url(
+        r'^posts/(?P<id>\d+)/comments/?$', PostCommentListView.as_view(),
+        name='post-comments'
+    ),
     url(r'^comments/?$', CommentCreateView.as_view(), name='comment-create')
 
 ]
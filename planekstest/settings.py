@@ -55,12 +55,16 @@ REST_FRAMEWORK = {
                  'rest_framework.parsers.MultiPartParser',
              ),
              'DEFAULT_AUTHENTICATION_CLASSES': (
-                'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+                'api.v1.authentication.CachedJSONWebTokenAuthentication',
              ),
              'DEFAULT_PERMISSION_CLASSES': (
                 'rest_framework.permissions.AllowAny',
              ),
-            'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema'
+            'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+            # proxies in front of the app, throttling keys on the client
+            # address they add to X-Forwarded-For; with 0 the header sent
+            # by clients is ignored and REMOTE_ADDR is used
+            'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
         }
 JWT_AUTH = {
     'JWT_ENCODE_HANDLER':
@@ -129,6 +133,79 @@ DATABASES = {
 
 
 
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+# rendered public posts feed, invalidated by feed generation
+POSTS_FEED_CACHE_TIMEOUT = 60 * 5
+# rendered post details, invalidated by per post version
+POSTS_DETAIL_CACHE_TIMEOUT = 60 * 60
+# comments embedded in post details, the rest are paged separately
+POST_DETAIL_COMMENTS = 10
+# seconds users of JWT authenticated requests are cached for
+AUTH_USER_CACHE_TIMEOUT = 60
+# versions, generations and hit counters of the cached responses above;
+# must not be shorter than the responses, an expired version is renewed
+CACHE_VERSION_TIMEOUT = max(
+    POSTS_FEED_CACHE_TIMEOUT, POSTS_DETAIL_CACHE_TIMEOUT,
+    AUTH_USER_CACHE_TIMEOUT,
+)
+# last_login of logins is buffered in the cache and written every this many
+# seconds by the beat; the cache must be shared by web and celery processes
+LAST_LOGIN_FLUSH_INTERVAL = 60
+LAST_LOGIN_BUFFERED = CACHES['default']['BACKEND'] != \
+    'django.core.cache.backends.locmem.LocMemCache'
+# token buckets of throttled views: (capacity, tokens refilled per second)
+THROTTLE_BUCKETS = {
+    'login_ip': (60, 1),
+    'login_account': (10, 10 / 60),
+    'register_ip': (20, 20 / 3600),
+    'comment_ip': (20, 1 / 3),
+    'comment_post': (60, 1),
+}
+# buckets are kept in Redis by an atomic script, in the cache if not set
+THROTTLE_REDIS_URL = os.environ.get('THROTTLE_REDIS_URL')
+# seconds, throttling is off while Redis does not answer
+THROTTLE_REDIS_TIMEOUT = 0.1
+# new comment notifications of a recipient are sent in one digest
+# once per this window, seconds
+COMMENT_NOTIFICATION_WINDOW = 5 * 60
+
+
+# storage class of uploaded images, None is DEFAULT_FILE_STORAGE
+UPLOADED_IMAGES_STORAGE = os.environ.get('UPLOADED_IMAGES_STORAGE')
+# collect_image_garbage runs in celery: with a file system storage
+# MEDIA_ROOT and IMAGE_UPLOAD_SESSIONS_DIR must be shared by web and celery
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', '')
+
+# resumable image uploads
+# chunks are collected in a local directory, whatever the images storage is
+IMAGE_UPLOAD_SESSIONS_DIR = os.environ.get(
+    'IMAGE_UPLOAD_SESSIONS_DIR', os.path.join(BASE_DIR, 'upload_sessions'),
+)
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+# request body is copied to the file by buffers of this size
+IMAGE_UPLOAD_BUFFER_SIZE = 64 * 1024
+# uploaded images are deduplicated by the hash made by these handlers
+FILE_UPLOAD_HANDLERS = [
+    'api.upload_handlers.ContentHashMemoryFileUploadHandler',
+    'api.upload_handlers.ContentHashTemporaryFileUploadHandler',
+]
+# widths of downscaled copies made for every uploaded image
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+IMAGE_DERIVATIVE_QUALITY = 80
+# garbage collection of images, TTLs are in seconds
+UNATTACHED_IMAGE_TTL = 24 * 60 * 60
+STRAY_FILE_TTL = 24 * 60 * 60
+IMAGE_UPLOAD_SESSION_TTL = 24 * 60 * 60
+IMAGE_GC_BATCH_SIZE = 500
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 AUTH_USER_MODEL = 'api.AuthUser'
@@ -165,6 +242,36 @@ REDIS_CONNECTION_STRING=os.environ.get(
 BROKER_URL = REDIS_CONNECTION_STRING
 BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_CONNECTION_STRING')
+CELERYBEAT_SCHEDULE = {
+    'collect-image-garbage': {
+        'task': 'planekstest.tasks.collect_image_garbage',
+        'schedule': timedelta(hours=1),
+    },
+    'flush-last-logins': {
+        'task': 'planekstest.tasks.flush_last_login_buffer',
+        'schedule': timedelta(seconds=LAST_LOGIN_FLUSH_INTERVAL),
+    },
+    'sweep-comment-digests': {
+        'task': 'planekstest.tasks.sweep_new_comment_digests',
+        'schedule': timedelta(seconds=COMMENT_NOTIFICATION_WINDOW),
+    },
+}
+# tasks published by relay_task_outbox in one transaction
+TASK_OUTBOX_BATCH_SIZE = 500
+# seconds relay_task_outbox waits when the outbox is empty
+TASK_OUTBOX_POLL_INTERVAL = 1
+# seconds to wait for the broker when publishing a task
+TASK_PUBLISH_TIMEOUT = 1
+# while the broker is down tasks wait in a queue of this size in the
+# publishing process, the threads retry publishing and then run them there
+TASK_FALLBACK_QUEUE_SIZE = 1000
+TASK_FALLBACK_WORKERS = 2
+TASK_FALLBACK_RETRIES = 3
+# seconds between publishing attempts while the broker is down
+TASK_FALLBACK_RETRY_INTERVAL = 5
+# seconds a task queued in the fallback is kept from other relays,
+# counted from its eta
+TASK_FALLBACK_CLAIM_TIMEOUT = 60 * 10
 
 LANGUAGE_CODE = 'en-us'
 
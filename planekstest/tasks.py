@@ -1,8 +1,21 @@
+import hashlib
 import logging
+from collections import OrderedDict
+from datetime import timedelta
 
+from celery.signals import worker_shutdown
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 
-from api.mailing import send_register_email, send_new_comment
+from api.images import make_derivatives, collect_garbage
+from api.last_login import flush_last_logins
+from api.mailing import send_register_email, send_register_emails, \
+    send_new_comment, send_new_comments_bulk
+from api.models import UploadedImage, PendingCommentNotification
+from api.outbox import enqueue_task
 #from api.v1.post.serializers import PostCreateSerializer
 from planekstest.celery import app
 
@@ -16,7 +29,145 @@ def send_verification_email(user_id, token):
     except UserModel.DoesNotExist:
         logging.warning("Tried to send email to non-existing user '%s'" % user_id)
 
+
+@app.task
+def send_verification_emails(user_ids, token):
+    """
+    Sends verification emails of many users over one mail connection
+    """
+    users = get_user_model().objects.filter(pk__in=user_ids).order_by('id')
+    failed = send_register_emails(users.iterator(), token)
+    if failed:
+        logging.warning("Failed to send verification emails to %s" % failed)
+
+
+COMMENT_DIGEST_KEY = 'comments:digest:%s'
+
+
 @app.task
 def send_new_comment_email(target_email, post_link):
     send_new_comment(target_email, post_link)
 
+
+def notify_new_comment(target_email, post_link):
+    """
+    Buffers the notification, all notifications of the recipient within
+    COMMENT_NOTIFICATION_WINDOW are sent by one task in one email
+    """
+    PendingCommentNotification.objects.create(
+        recipient=target_email, post_link=post_link,
+    )
+    window = settings.COMMENT_NOTIFICATION_WINDOW
+    key = COMMENT_DIGEST_KEY % hashlib.md5(
+        target_email.encode('utf-8'),
+    ).hexdigest()
+
+    def schedule_digest():
+        # the task deletes the flag, the timeout is only for a lost task
+        if cache.add(key, 1, window * 2):
+            enqueue_task(
+                send_new_comment_digest, (target_email,), countdown=window,
+            )
+
+    # a rolled back comment must not leave the flag without a task
+    transaction.on_commit(schedule_digest)
+
+
+@app.task
+def send_new_comment_digest(target_email):
+    cache.delete(COMMENT_DIGEST_KEY % hashlib.md5(
+        target_email.encode('utf-8'),
+    ).hexdigest())
+    send_new_comment_digests([target_email])
+
+
+@app.task
+def send_new_comment_digests(target_emails=None):
+    """
+    Sends pending digests of target_emails, or of everyone if None,
+    over one mail connection; notifications of failed digests are kept
+    """
+    with transaction.atomic():
+        # locked rows keep a concurrent digest from sending them twice
+        pending = PendingCommentNotification.objects.select_for_update(
+        ).order_by('id')
+        if target_emails is not None:
+            pending = pending.filter(recipient__in=target_emails)
+        digests = OrderedDict()
+        pending_ids = {}
+        for notification in pending:
+            counts = digests.setdefault(notification.recipient, OrderedDict())
+            counts[notification.post_link] = \
+                counts.get(notification.post_link, 0) + 1
+            pending_ids.setdefault(notification.recipient, []).append(
+                notification.id,
+            )
+        if not digests:
+            return
+        failed = set(send_new_comments_bulk(
+            (recipient, list(counts.items()))
+            for recipient, counts in digests.items()
+        ))
+        sent_ids = [
+            notification_id
+            for recipient, ids in pending_ids.items()
+            if recipient not in failed
+            for notification_id in ids
+        ]
+        PendingCommentNotification.objects.filter(id__in=sent_ids).delete()
+
+
+@app.task
+def sweep_new_comment_digests():
+    """
+    Sends digests whose task was lost, notifications of them are older
+    than two COMMENT_NOTIFICATION_WINDOW
+    """
+    recipients = PendingCommentNotification.objects.filter(
+        date_created__lt=timezone.now() - timedelta(
+            seconds=settings.COMMENT_NOTIFICATION_WINDOW * 2,
+        ),
+    ).values_list('recipient', flat=True).distinct()
+    recipients = list(recipients)
+    if recipients:
+        send_new_comment_digests(recipients)
+
+
+@app.task
+def generate_image_derivatives(image_id):
+    try:
+        image = UploadedImage.objects.get(id=image_id)
+    except UploadedImage.DoesNotExist:
+        logging.warning("Tried to resize non-existing image '%s'" % image_id)
+        return
+    if make_derivatives(image):
+        # imported here, signals import tasks to schedule this one
+        from api.signals import touch_image_posts, touch_images_posts
+        if image.blob_id is None:
+            touch_image_posts(image)
+        else:
+            # every image of the content shows the new derivatives
+            touch_images_posts(*image.blob.images.values_list(
+                'id', flat=True,
+            ))
+
+
+@app.task
+def collect_image_garbage():
+    stats = collect_garbage()
+    logging.info(
+        "Collected %(images)s images, %(files)s files and %(sessions)s "
+        "upload sessions, %(bytes)s bytes reclaimed" % stats
+    )
+    return stats
+
+
+@app.task
+def flush_last_login_buffer():
+    return flush_last_logins()
+
+
+@worker_shutdown.connect
+def flush_last_login_buffer_on_shutdown(**kwargs):
+    # the beat job may not run again soon, e.g. during a deploy
+    flush_last_logins()